@@ -36,7 +36,8 @@ def make_launch_configuration(t, tier, security_groups, user_data, instance_prof
 
 # tier is one of 'spa', 'api', 'admin'
 # tags is a list of the tag names for this asg, which must correspond to stack parameters
-def make_autoscaling_group(t, tier, lc, target_group, tags):
+# extra_tags is a list of additional Tag objects whose values do not come from parameters, e.g. the cache endpoint
+def make_autoscaling_group(t, tier, lc, target_group, tags, extra_tags=()):
     asg = t.add_resource(AutoScalingGroup(
         tier + "ASG",
         DesiredCapacity=Ref(tier + "InitialASGSize"),
@@ -62,9 +63,9 @@ def make_autoscaling_group(t, tier, lc, target_group, tags):
         # each of these tag names there is a stack parameter called tag_name_to_param_name(tier, tag_name).
         # For example: a tag called 'spa-env-file' and a stack parameter called 'spaEnvFile'.
         # So the map() with the lambda function creates a list of Tag objects such as
-        # Tag('env-file', Ref('spaEnvFile', True). Additionally, add the lh-app and lh-app-env tags.
+        # Tag('env-file', Ref('spaEnvFile', True). Additionally, add the lh-app and lh-app-env tags and extra_tags.
         Tags=list(map(lambda tag_name: Tag(tag_name, Ref(tag_name_to_param_name(tier, tag_name)), True), tags)) \
-             + [Tag('lh-app', Ref('lhAppTag'), True), Tag('lh-app-env', Ref('lhAppEnvTag'), True)]
+             + [Tag('lh-app', Ref('lhAppTag'), True), Tag('lh-app-env', Ref('lhAppEnvTag'), True)] + list(extra_tags)
     ))
 
     spec = PredefinedMetricSpecification(PredefinedMetricType="ASGAverageCPUUtilization")
@@ -80,3 +81,14 @@ def make_autoscaling_group(t, tier, lc, target_group, tags):
     ))
 
     return asg
+
+
+# Blue/green: make the green launch configuration and ASG of a tier, to run next to the blue ones made by
+# make_launch_configuration() and make_autoscaling_group(). The green resources and the stack parameters they use
+# are named tier + 'Green' (spaGreenLC, spaGreenASG, spaGreenAMI, spaGreenInitialASGSize, ...), and the ASG
+# registers with target_groups[tier + 'Green'].
+def make_green_autoscaling_group(t, tier, security_groups, user_data, instance_profile, target_groups, tags,
+                                 extra_tags=()):
+    green = tier + 'Green'
+    lc = make_launch_configuration(t, green, security_groups, user_data, instance_profile)
+    return make_autoscaling_group(t, green, lc, target_groups[green], tags, extra_tags)
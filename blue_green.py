@@ -0,0 +1,201 @@
+# Written for Python 3
+
+# Shifts ALB traffic of one tier between its blue and green target groups (see BLUE_GREEN_TIERS in
+# make_app_cluster.py) in steps, watching the tier's TargetResponseTime alarm for the color receiving traffic.
+# If the alarm fires during a step, the weights go straight back to where they started. Both ASGs stay up the whole
+# time, so releases and rollbacks happen at full capacity: nothing is rebuilt in place and no instance is cycled.
+#
+# The ASGs have no UpdatePolicy, so a stack update that changes a color's AMI or repo branch replaces its launch
+# configuration but leaves running instances on the old one (autoredeploy reads each instance's own tags, which
+# do not change either). The idle color must therefore have no instances when its release is set. A release,
+# here to green, looks like:
+#   1. update the stack: green ASG size = 0 (if it is still up from the previous release)
+#   2. update the stack: green AMI/repo-branch = new release, green ASG size = blue ASG size
+#   3. python blue_green.py --stack refapp-prod-app --tier api --to green
+#   4. once happy, scale the blue ASG down to 0; the next release goes --to blue the same way
+# shift() refuses to start while the target color still has instances from an older launch configuration.
+#
+# The weights are changed directly on the listeners and rules, which takes effect within seconds. At the end the
+# final weights are written back to the stack's BlueWeight/GreenWeight parameters, so the next stack update does not
+# undo them (skip this with --no-sync-stack).
+#
+# Usage: python blue_green.py --stack STACK --tier {spa,api,admin} --to {blue,green} [--steps 10,25,50,100]
+#                             [--bake 180] [--region us-east-2]
+
+import argparse
+import time
+
+DEFAULT_REGION = 'us-east-2'
+DEFAULT_STEPS = [10, 25, 50, 100]
+
+# the TargetResponseTime alarms evaluate one 60 second period, so this is three chances to fire per step
+DEFAULT_BAKE_SECONDS = 180
+ALARM_POLL_SECONDS = 15
+
+# logical ids in make_app_cluster/load_balancer.py. The SPA tier is the default action of the listeners; the API
+# and admin tiers each have a host-header rule on both listeners.
+LISTENERS = ['httpListener', 'httpsListener']
+RULE_SUFFIXES = {'api': 'Api', 'admin': 'Admin'}
+
+CAPABILITIES = ['CAPABILITY_IAM']
+
+
+class ReleaseError(Exception):
+    pass
+
+
+class BlueGreenController(object):
+    def __init__(self, stack, tier, cloudformation, elbv2, cloudwatch, autoscaling, sleep=time.sleep, log=print):
+        self.stack = stack
+        self.tier = tier
+        self.cloudformation = cloudformation
+        self.elbv2 = elbv2
+        self.cloudwatch = cloudwatch
+        self.autoscaling = autoscaling
+        self.sleep = sleep
+        self.log = log
+
+        response = cloudformation.describe_stack_resources(StackName=stack)
+        self.resources = {r['LogicalResourceId']: r['PhysicalResourceId'] for r in response['StackResources']}
+        if tier + 'GreenTG' not in self.resources:
+            raise ReleaseError('{} has no green target group for the {} tier'.format(stack, tier))
+
+    def __physical(self, color, suffix):
+        return self.resources[self.tier + ('Green' if color == 'green' else '') + suffix]
+
+    def __forward_action(self, blue, green):
+        return [{
+            'Type': 'forward',
+            'ForwardConfig': {'TargetGroups': [
+                {'TargetGroupArn': self.__physical('blue', 'TG'), 'Weight': blue},
+                {'TargetGroupArn': self.__physical('green', 'TG'), 'Weight': green},
+            ]}
+        }]
+
+    # current (blue, green) weights, read from the first listener or rule of the tier
+    def weights(self):
+        if self.tier in RULE_SUFFIXES:
+            rule_arn = self.resources[LISTENERS[0] + 'Rule' + RULE_SUFFIXES[self.tier]]
+            actions = self.elbv2.describe_rules(RuleArns=[rule_arn])['Rules'][0]['Actions']
+        else:
+            listener_arn = self.resources[LISTENERS[0]]
+            actions = self.elbv2.describe_listeners(ListenerArns=[listener_arn])['Listeners'][0]['DefaultActions']
+        weights = {tg['TargetGroupArn']: tg.get('Weight', 0) for tg in actions[0]['ForwardConfig']['TargetGroups']}
+        return weights.get(self.__physical('blue', 'TG'), 0), weights.get(self.__physical('green', 'TG'), 0)
+
+    def set_weights(self, blue, green):
+        actions = self.__forward_action(blue, green)
+        for listener in LISTENERS:
+            if self.tier in RULE_SUFFIXES:
+                self.elbv2.modify_rule(RuleArn=self.resources[listener + 'Rule' + RULE_SUFFIXES[self.tier]],
+                                       Actions=actions)
+            else:
+                self.elbv2.modify_listener(ListenerArn=self.resources[listener], DefaultActions=actions)
+        self.log('{} weights: blue={} green={}'.format(self.tier, blue, green))
+
+    # (current, stale) instances of the color's ASG: current ones run its current launch configuration, stale ones
+    # an older one
+    def __instances(self, color):
+        response = self.autoscaling.describe_auto_scaling_groups(AutoScalingGroupNames=[self.__physical(color, 'ASG')])
+        group = response['AutoScalingGroups'][0]
+        current, stale = [], []
+        for i in group['Instances']:
+            on_current = i.get('LaunchConfigurationName') == group.get('LaunchConfigurationName')
+            (current if on_current else stale).append(i)
+        return current, stale
+
+    # number of healthy InService instances in the color's ASG that run its current launch configuration
+    def in_service(self, color):
+        current, _ = self.__instances(color)
+        return len([i for i in current if i['LifecycleState'] == 'InService' and i['HealthStatus'] == 'Healthy'])
+
+    def alarm_state(self, color):
+        name = self.__physical(color, 'TargetResponseTimeAlarm')
+        return self.cloudwatch.describe_alarms(AlarmNames=[name])['MetricAlarms'][0]['StateValue']
+
+    # watch the alarm of the color taking traffic for the given time; False as soon as it is in ALARM
+    def __bake(self, color, seconds):
+        waited = 0
+        while True:
+            if self.alarm_state(color) == 'ALARM':
+                return False
+            if waited >= seconds:
+                return True
+            self.sleep(min(ALARM_POLL_SECONDS, seconds - waited))
+            waited += ALARM_POLL_SECONDS
+
+    # Shift traffic to color 'to' through the given percentages. Rolls back to the starting weights and raises
+    # ReleaseError if the alarm fires. Refuses to start while 'to' has instances from an older launch
+    # configuration, and, unless check_capacity is False, unless 'to' has at least as many healthy current
+    # instances as the other color.
+    def shift(self, to, steps=DEFAULT_STEPS, bake=DEFAULT_BAKE_SECONDS, check_capacity=True):
+        source = 'blue' if to == 'green' else 'green'
+        start = self.weights()
+        _, stale = self.__instances(to)
+        if stale:
+            raise ReleaseError('{} {} has {} instances from an older launch configuration; scale it to 0 and back up '
+                               'first'.format(self.tier, to, len(stale)))
+        if check_capacity:
+            have, need = self.in_service(to), self.in_service(source)
+            if have < need:
+                raise ReleaseError('{} {} has {} healthy instances, {} has {}; scale it up first'.format(
+                    self.tier, to, have, source, need))
+
+        for percent in steps:
+            to_weight, source_weight = percent, 100 - percent
+            self.set_weights(*((source_weight, to_weight) if to == 'green' else (to_weight, source_weight)))
+            if not self.__bake(to, bake):
+                self.set_weights(*start)
+                raise ReleaseError('{} {} TargetResponseTime alarm fired at {}%; rolled back'.format(
+                    self.tier, to, percent))
+        return self.weights()
+
+    # record the weights as the stack's parameter values, keeping everything else as it is
+    def sync_stack(self, blue, green):
+        stack = self.cloudformation.describe_stacks(StackName=self.stack)['Stacks'][0]
+        weights = {self.tier + 'BlueWeight': str(blue), self.tier + 'GreenWeight': str(green)}
+        parameters = []
+        for p in stack['Parameters']:
+            key = p['ParameterKey']
+            if key in weights:
+                parameters.append({'ParameterKey': key, 'ParameterValue': weights[key]})
+            else:
+                parameters.append({'ParameterKey': key, 'UsePreviousValue': True})
+        self.cloudformation.update_stack(StackName=self.stack, UsePreviousTemplate=True, Parameters=parameters,
+                                         Capabilities=CAPABILITIES)
+        self.log('updating {} parameters {}'.format(self.stack, weights))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shift ALB traffic of a tier between its blue and green ASGs')
+    parser.add_argument('--stack', required=True, help='app-cluster stack name')
+    parser.add_argument('--tier', required=True, choices=['spa', 'api', 'admin'])
+    parser.add_argument('--to', required=True, choices=['blue', 'green'], help='color to shift traffic to')
+    parser.add_argument('--steps', default=','.join(map(str, DEFAULT_STEPS)),
+                        help='comma-separated percentages of traffic for the target color')
+    parser.add_argument('--bake', type=int, default=DEFAULT_BAKE_SECONDS, help='seconds to watch each step')
+    parser.add_argument('--region', default=DEFAULT_REGION)
+    parser.add_argument('--no-capacity-check', action='store_true',
+                        help='shift even if the target color has fewer healthy instances')
+    parser.add_argument('--no-sync-stack', action='store_true',
+                        help='do not write the final weights back to the stack parameters')
+    args = parser.parse_args()
+
+    import boto3
+    controller = BlueGreenController(args.stack, args.tier,
+                                     boto3.client('cloudformation', region_name=args.region),
+                                     boto3.client('elbv2', region_name=args.region),
+                                     boto3.client('cloudwatch', region_name=args.region),
+                                     boto3.client('autoscaling', region_name=args.region))
+    try:
+        blue, green = controller.shift(args.to, [int(s) for s in args.steps.split(',')], args.bake,
+                                       not args.no_capacity_check)
+    except ReleaseError as e:
+        print('error: {}'.format(e))
+        raise SystemExit(1)
+    if not args.no_sync_stack:
+        controller.sync_stack(blue, green)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+from troposphere import Ref, GetAtt, If, Tags, Join
+from troposphere.elasticache import ReplicationGroup, SubnetGroup
+
+# a primary and one replica, in different AZs, so the cache survives losing a node or an AZ
+CACHE_NODES = 2
+
+
+# Create a Redis replication group for the API tier's sessions, cache and queues, in the same subnets as the
+# instances. Only created when the CreateCache parameter is True; the ASGs of the API tier pass its endpoint to
+# instances through the cache-endpoint tag (see cache_endpoint() and user_data_api.sh).
+def make_cache(t, security_group):
+    subnet_group = t.add_resource(SubnetGroup(
+        "cacheSubnetGroup",
+        Condition='create_cache',
+        Description='Subnets for the API cache',
+        SubnetIds=[Ref('Subnet1'), Ref('Subnet2'), Ref('Subnet3')]
+    ))
+
+    cache = t.add_resource(ReplicationGroup(
+        "cache",
+        Condition='create_cache',
+        ReplicationGroupDescription='Sessions, cache and queues for the API tier',
+        Engine='redis',
+        CacheNodeType=Ref('CacheNodeType'),
+        NumCacheClusters=CACHE_NODES,
+        AutomaticFailoverEnabled=True,
+        MultiAZEnabled=True,
+        CacheSubnetGroupName=Ref(subnet_group),
+        SecurityGroupIds=[GetAtt(security_group, 'GroupId')],
+        Tags=Tags({'lh-app': Ref('lhAppTag'), 'lh-app-env': Ref('lhAppEnvTag')})
+    ))
+
+    return cache
+
+
+# the cache's primary endpoint address, or an empty string when there is no cache
+def cache_endpoint(cache):
+    return If('create_cache', GetAtt(cache, 'PrimaryEndPoint.Address'), '')
+
+
+# The user-data script with the cache endpoint written into a comment after its first line. The tag alone only
+# reaches instances launched after it changes; with the endpoint in the user-data, switching CreateCache (or a
+# replaced cache) also replaces the launch configuration, so running instances show up as stale in
+# template_diff.py and blue_green.py refuses to shift traffic onto them.
+def with_cache_endpoint(user_data, cache):
+    first_line, _, rest = user_data.partition('\n')
+    return Join('', [first_line, '\n# cache endpoint: ', cache_endpoint(cache), '\n', rest])
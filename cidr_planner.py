@@ -0,0 +1,122 @@
+# Written for Python 3
+
+# Plans VPC and subnet CIDR blocks. Every VPC gets one public and one private subnet in each of N availability
+# zones, all carved out of the VPC CIDR without overlap. When planning several VPCs at once (e.g. dev, staging
+# and prod, or one per region), each new VPC gets the first free block of the supernet that does not collide with
+# any VPC already recorded in the registry, so environments can later be peered or VPN'd together.
+#
+# The registry is a JSON file mapping environment name to VPC CIDR, e.g. {"prod-us-east-2": "10.0.0.0/16"}.
+# make_vpc.py and deploy.py name each environment and region with registry_key(), so both find the same entry.
+#
+# Usage: python cidr_planner.py [--registry vpc_registry.json] [--azs 3] [--save] dev-us-east-2 prod-us-east-2
+
+import argparse
+import ipaddress
+import json
+import os
+import string
+from collections import namedtuple
+
+DEFAULT_SUPERNET = '10.0.0.0/8'
+DEFAULT_AZ_COUNT = 3
+VPC_PREFIX = 16
+SUBNET_PREFIX = 24
+
+# The original hand-written VPC template left the first /24 unused and put SubnetA, SubnetB and SubnetC at
+# 10.x.1.0/24, 10.x.2.0/24 and 10.x.3.0/24, all in the first AZ. SubnetA keeps its block and AZ, so it is left
+# alone. SubnetB and SubnetC move to other AZs, which replaces them, and CloudFormation creates the replacement
+# before deleting the old subnet, so they get blocks from after these LEGACY_BLOCKS instead: the old blocks 2 and 3
+# are never reused, and an existing VPC stack can be updated in place.
+LEGACY_BLOCKS = 4
+
+# az_index is the index into GetAZs() that the subnet lives in
+SubnetPlan = namedtuple('SubnetPlan', ['name', 'cidr', 'az_index'])
+VpcPlan = namedtuple('VpcPlan', ['name', 'cidr', 'public', 'private'])
+
+
+# the registry name of an environment's VPC in a region, e.g. 'prod-us-east-2'
+def registry_key(env, region):
+    return '{}-{}'.format(env, region)
+
+
+def load_registry(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_registry(path, registry):
+    with open(path, 'w') as f:
+        json.dump(registry, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+# raise ValueError if any two environments in the registry have overlapping VPC CIDRs
+def check_collisions(registry):
+    networks = sorted((ipaddress.ip_network(cidr), name) for name, cidr in registry.items())
+    for (a, a_name), (b, b_name) in zip(networks, networks[1:]):
+        if a.overlaps(b):
+            raise ValueError('VPC CIDR {} of {} overlaps {} of {}'.format(a, a_name, b, b_name))
+
+
+# Split a VPC CIDR into public subnets SubnetA, SubnetB, ... and private subnets PrivateSubnetA, ..., one of
+# each per AZ. Subnet names are what make_vpc uses as logical ids.
+def plan_vpc(name, cidr, az_count=DEFAULT_AZ_COUNT, subnet_prefix=SUBNET_PREFIX):
+    vpc = ipaddress.ip_network(cidr)
+    if az_count < 1 or az_count > len(string.ascii_uppercase):
+        raise ValueError('az_count must be between 1 and {}'.format(len(string.ascii_uppercase)))
+    needed = LEGACY_BLOCKS + 2 * az_count - 1
+    if subnet_prefix < vpc.prefixlen or 2 ** (subnet_prefix - vpc.prefixlen) < needed:
+        raise ValueError('{} is too small for {} /{} subnets'.format(vpc, needed, subnet_prefix))
+
+    blocks = vpc.subnets(new_prefix=subnet_prefix)
+    legacy = [next(blocks) for _ in range(LEGACY_BLOCKS)]
+    cidrs = [str(legacy[1])] + [str(next(blocks)) for _ in range(2 * az_count - 1)]
+    public = [SubnetPlan('Subnet' + string.ascii_uppercase[i], cidrs[i], i) for i in range(az_count)]
+    private = [SubnetPlan('PrivateSubnet' + string.ascii_uppercase[i], cidrs[az_count + i], i)
+               for i in range(az_count)]
+    return VpcPlan(name, str(vpc), public, private)
+
+
+# Plan several VPCs at once. Environments already in the registry keep their CIDR; new ones get the first free
+# /vpc_prefix block of the supernet. The registry dict is updated in place with the new allocations.
+def plan_vpcs(names, registry, az_count=DEFAULT_AZ_COUNT, supernet=DEFAULT_SUPERNET, vpc_prefix=VPC_PREFIX):
+    check_collisions(registry)
+    taken = [ipaddress.ip_network(cidr) for cidr in registry.values()]
+    candidates = ipaddress.ip_network(supernet).subnets(new_prefix=vpc_prefix)
+
+    plans = []
+    for name in names:
+        if name not in registry:
+            for candidate in candidates:
+                if not any(candidate.overlaps(n) for n in taken):
+                    registry[name] = str(candidate)
+                    taken.append(candidate)
+                    break
+            else:
+                raise ValueError('no free /{} left in {} for {}'.format(vpc_prefix, supernet, name))
+        plans.append(plan_vpc(name, registry[name], az_count))
+    return plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plan non-overlapping VPC and subnet CIDRs')
+    parser.add_argument('names', nargs='+', help='registry keys (see registry_key), e.g. dev-us-east-2 prod-us-east-2')
+    parser.add_argument('--registry', help='JSON file of existing environments and their VPC CIDRs')
+    parser.add_argument('--azs', type=int, default=DEFAULT_AZ_COUNT, help='number of availability zones')
+    parser.add_argument('--supernet', default=DEFAULT_SUPERNET, help='block to allocate new VPCs from')
+    parser.add_argument('--save', action='store_true', help='write new allocations back to the registry')
+    args = parser.parse_args()
+
+    registry = load_registry(args.registry)
+    plans = plan_vpcs(args.names, registry, args.azs, args.supernet)
+    print(json.dumps({p.name: {'cidr': p.cidr,
+                               'public': {s.name: s.cidr for s in p.public},
+                               'private': {s.name: s.cidr for s in p.private}} for p in plans}, indent=2))
+    if args.save and args.registry:
+        save_registry(args.registry, registry)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,537 @@
+# Written for Python 3
+
+# Deploys the VPC and app-cluster stacks for one or more environments and regions. Stacks that do not depend on
+# each other (different environments, different regions) are deployed concurrently, at most --max-parallel at a
+# time; a stack whose parameters come from another stack's outputs (the app cluster takes VPC and Subnet1..3 from
+# its VPC stack) waits for that stack and no longer.
+#
+# Every deploy goes through a change set named after a hash of the template and parameters, so re-running an
+# interrupted deploy reuses the change set it already created, and a stack whose template and parameters are
+# unchanged is left alone. Stack and change-set status is polled with exponential backoff and jitter.
+#
+# Like 'aws cloudformation deploy', an update keeps the stack's current value of every parameter this script does
+# not set (UsePreviousValue), so values set by hand or by blue_green.py are not reset to their defaults. Values
+# per environment come from --param env:NAME=VALUE or a --params-file of {"env": {"NAME": "VALUE"}}; each goes to
+# the stacks of that environment whose template has the parameter.
+#
+# The CloudFormation calls go through a backend: Boto3Backend talks to AWS, LocalBackend is an in-process
+# stand-in with simulated latency, for testing and benchmarking the orchestration offline.
+#
+# Usage: python deploy.py --env dev --env staging --registry vpc_registry.json [--region us-east-2 ...]
+#                         [--param prod:CreateCache=True ...] [--params-file params.json] [--max-parallel 4]
+#                         [--template-bucket BUCKET] [--local [--latency 0.05]]
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import namedtuple, Counter
+
+import make_app_cluster
+import make_vpc
+from cidr_planner import load_registry, save_registry, plan_vpcs, registry_key
+
+DEFAULT_REGION = 'us-east-2'
+DEFAULT_MAX_PARALLEL = 4
+
+# make_app_cluster parameters filled in from the outputs of the VPC stack of the same environment and region
+VPC_OUTPUT_PARAMETERS = ['VPC', 'Subnet1', 'Subnet2', 'Subnet3']
+
+# the app cluster creates an IAM role and instance profile
+CAPABILITIES = ['CAPABILITY_IAM']
+
+# largest template CloudFormation accepts inline (TemplateBody); bigger ones must be uploaded to S3 (TemplateURL)
+MAX_TEMPLATE_BODY = 51200
+
+COMPLETE_STATUSES = {'CREATE_COMPLETE', 'UPDATE_COMPLETE', 'IMPORT_COMPLETE'}
+NO_CHANGES_REASONS = ("didn't contain changes", 'No updates are to be performed')
+
+# the value of output 'output' of the stack with key 'stack' (see Stack.key), used as a parameter value of another
+# stack
+StackOutput = namedtuple('StackOutput', ['stack', 'output'])
+
+# status is the final stack status, or 'UNCHANGED' when there was nothing to deploy
+StackResult = namedtuple('StackResult', ['name', 'region', 'status', 'outputs', 'change_set', 'reused', 'elapsed'])
+
+
+class DeployError(Exception):
+    pass
+
+
+# A stack to deploy. template is a callable returning a troposphere Template; parameter values may be plain
+# strings or StackOutput references, which make this stack depend on the referenced one. The same stack name can
+# be deployed to several regions, so stacks are identified by their key, '<region>/<name>'.
+class Stack(object):
+    def __init__(self, name, template, region=DEFAULT_REGION, parameters=None, depends_on=()):
+        self.name = name
+        self.template = template
+        self.region = region
+        self.parameters = parameters or {}
+        self.depends_on = list(depends_on)
+
+    @property
+    def key(self):
+        return self.region + '/' + self.name
+
+    def dependencies(self):
+        deps = list(self.depends_on)
+        deps += [v.stack for v in self.parameters.values() if isinstance(v, StackOutput) and v.stack not in deps]
+        return deps
+
+
+# Render a template as compact JSON, to keep it as far as possible under the TemplateBody size limit.
+def render_template(template):
+    return json.dumps(template.to_dict(), separators=(',', ':'), sort_keys=True)
+
+
+def change_set_name(body, parameters, use_previous=()):
+    digest = hashlib.sha1(body.encode('utf-8'))
+    digest.update(json.dumps([parameters, sorted(use_previous)], sort_keys=True).encode('utf-8'))
+    return 'deploy-' + digest.hexdigest()[:16]
+
+
+# Call check() until it returns something other than None, sleeping between calls with exponential backoff and
+# full jitter, so a dozen concurrent waits neither hammer the API in lockstep nor sit idle for a fixed interval.
+async def wait_with_backoff(check, initial=1.0, maximum=20.0, factor=1.6, timeout=3600.0):
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    delay = initial
+    while True:
+        result = await check()
+        if result is not None:
+            return result
+        if loop.time() >= deadline:
+            raise DeployError('timed out after {:.0f}s'.format(timeout))
+        await asyncio.sleep(random.uniform(0, delay))
+        delay = min(maximum, delay * factor)
+
+
+class Orchestrator(object):
+    def __init__(self, backend, max_parallel=DEFAULT_MAX_PARALLEL, poll_initial=1.0, poll_maximum=20.0,
+                 timeout=3600.0):
+        self.backend = backend
+        self.max_parallel = max_parallel
+        self.poll_initial = poll_initial
+        self.poll_maximum = poll_maximum
+        self.timeout = timeout
+
+    # Deploy all stacks, respecting dependencies. Returns {stack key: StackResult or the exception it failed with}.
+    # A failed stack does not stop independent stacks; stacks depending on it fail with DeployError.
+    async def deploy(self, stacks):
+        by_key = {s.key: s for s in stacks}
+        if len(by_key) != len(stacks):
+            raise DeployError('duplicate stacks')
+        self.__check_dependencies(by_key)
+
+        # render each template once, even if several stacks share a builder
+        bodies, rendered = {}, {}
+        for s in stacks:
+            if s.template not in rendered:
+                rendered[s.template] = render_template(s.template())
+            bodies[s.key] = rendered[s.template]
+
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        tasks = {}
+        for key in self.__topological_order(by_key):
+            stack = by_key[key]
+            deps = [tasks[d] for d in stack.dependencies()]
+            tasks[key] = asyncio.ensure_future(self.__deploy_after(stack, bodies[key], deps, semaphore))
+
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return dict(zip(tasks.keys(), results))
+
+    def __check_dependencies(self, by_key):
+        for s in by_key.values():
+            for dep in s.dependencies():
+                if dep not in by_key:
+                    raise DeployError('{} depends on unknown stack {}'.format(s.key, dep))
+
+    def __topological_order(self, by_key):
+        order, visiting, done = [], set(), set()
+
+        def visit(key):
+            if key in done:
+                return
+            if key in visiting:
+                raise DeployError('dependency cycle through ' + key)
+            visiting.add(key)
+            for dep in by_key[key].dependencies():
+                visit(dep)
+            visiting.discard(key)
+            done.add(key)
+            order.append(key)
+
+        for key in sorted(by_key):
+            visit(key)
+        return order
+
+    async def __deploy_after(self, stack, body, deps, semaphore):
+        outputs = {}
+        for dep in deps:
+            try:
+                result = await dep
+            except Exception as e:
+                raise DeployError('{} not deployed: dependency failed ({})'.format(stack.key, e))
+            outputs[result.region + '/' + result.name] = result.outputs
+
+        parameters = {}
+        for key, value in stack.parameters.items():
+            if isinstance(value, StackOutput):
+                if value.output not in outputs[value.stack]:
+                    raise DeployError('{} has no output {} for {}'.format(value.stack, value.output, stack.key))
+                value = outputs[value.stack][value.output]
+            parameters[key] = value
+
+        async with semaphore:
+            return await self.__apply(stack, body, parameters)
+
+    async def __wait(self, check):
+        return await wait_with_backoff(check, self.poll_initial, self.poll_maximum, timeout=self.timeout)
+
+    async def __settled_stack(self, stack):
+        async def check():
+            s = await self.backend.describe_stack(stack.region, stack.name)
+            if s is None or not s['status'].endswith('_IN_PROGRESS') or s['status'] == 'REVIEW_IN_PROGRESS':
+                return s or {}
+            return None
+        return await self.__wait(check) or None
+
+    async def __apply(self, stack, body, parameters):
+        started = time.monotonic()
+        region, name = stack.region, stack.name
+
+        existing = await self.__settled_stack(stack)
+        if existing and existing['status'] == 'ROLLBACK_COMPLETE':
+            raise DeployError('{} is in ROLLBACK_COMPLETE and must be deleted before it can be deployed'.format(name))
+        change_set_type = 'UPDATE' if existing and existing['status'] != 'REVIEW_IN_PROGRESS' else 'CREATE'
+
+        # on update, keep the stack's value of every parameter not set here (a parameter new to the template
+        # has no previous value and gets its Default)
+        use_previous = []
+        if change_set_type == 'UPDATE':
+            use_previous = sorted(k for k in json.loads(body).get('Parameters', {})
+                                  if k not in parameters and k in existing['parameters'])
+
+        cs_name = change_set_name(body, parameters, use_previous)
+        previous = {c['name']: c for c in await self.backend.list_change_sets(region, name)} if existing else {}
+        reused = cs_name in previous and previous[cs_name]['execution_status'] == 'AVAILABLE'
+        if not reused:
+            if cs_name in previous:
+                await self.backend.delete_change_set(region, name, cs_name)
+            await self.backend.create_change_set(region, name, cs_name, body, parameters, use_previous,
+                                                 change_set_type)
+
+        async def change_set_ready():
+            cs = await self.backend.describe_change_set(region, name, cs_name)
+            return cs if cs['status'] in ('CREATE_COMPLETE', 'FAILED') else None
+        cs = await self.__wait(change_set_ready)
+
+        if cs['status'] == 'FAILED':
+            if any(r in cs.get('reason', '') for r in NO_CHANGES_REASONS):
+                await self.backend.delete_change_set(region, name, cs_name)
+                return StackResult(name, region, 'UNCHANGED', existing['outputs'], cs_name, reused,
+                                   time.monotonic() - started)
+            raise DeployError('change set {} for {} failed: {}'.format(cs_name, name, cs.get('reason')))
+
+        await self.backend.execute_change_set(region, name, cs_name)
+        final = await self.__settled_stack(stack)
+        if final['status'] not in COMPLETE_STATUSES:
+            raise DeployError('{} ended in {}: {}'.format(name, final['status'], final.get('reason')))
+        return StackResult(name, region, final['status'], final['outputs'], cs_name, reused,
+                           time.monotonic() - started)
+
+
+# Backend talking to CloudFormation through boto3. boto3 is blocking, so calls run in the default executor.
+# Templates over MAX_TEMPLATE_BODY bytes (the app cluster, with its embedded user-data) are uploaded to
+# template_bucket and passed by URL.
+class Boto3Backend(object):
+    def __init__(self, template_bucket=None):
+        import boto3  # only needed when deploying for real
+        from botocore.exceptions import ClientError
+        self.boto3 = boto3
+        self.ClientError = ClientError
+        self.template_bucket = template_bucket
+        self.clients = {}
+
+    def __client(self, service, region):
+        if (service, region) not in self.clients:
+            self.clients[(service, region)] = self.boto3.client(service, region_name=region)
+        return self.clients[(service, region)]
+
+    async def __call(self, region, method, service='cloudformation', **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, lambda: getattr(self.__client(service, region), method)(**kwargs))
+
+    async def __template_argument(self, region, cs_name, body):
+        if len(body.encode('utf-8')) <= MAX_TEMPLATE_BODY:
+            return {'TemplateBody': body}
+        if not self.template_bucket:
+            raise DeployError('template is over {} bytes; pass --template-bucket'.format(MAX_TEMPLATE_BODY))
+        key = 'cloudformation/{}.json'.format(cs_name)
+        await self.__call(region, 'put_object', service='s3', Bucket=self.template_bucket, Key=key,
+                          Body=body.encode('utf-8'))
+        return {'TemplateURL': 'https://{}.s3.amazonaws.com/{}'.format(self.template_bucket, key)}
+
+    async def describe_stack(self, region, name):
+        try:
+            response = await self.__call(region, 'describe_stacks', StackName=name)
+        except self.ClientError as e:
+            if 'does not exist' in str(e):
+                return None
+            raise
+        s = response['Stacks'][0]
+        return {'status': s['StackStatus'], 'reason': s.get('StackStatusReason', ''),
+                'parameters': [p['ParameterKey'] for p in s.get('Parameters', [])],
+                'outputs': {o['OutputKey']: o['OutputValue'] for o in s.get('Outputs', [])}}
+
+    async def list_change_sets(self, region, name):
+        response = await self.__call(region, 'list_change_sets', StackName=name)
+        return [{'name': c['ChangeSetName'], 'status': c['Status'], 'execution_status': c['ExecutionStatus']}
+                for c in response['Summaries']]
+
+    async def create_change_set(self, region, name, cs_name, body, parameters, use_previous, change_set_type):
+        template = await self.__template_argument(region, cs_name, body)
+        values = [{'ParameterKey': k, 'ParameterValue': str(v)} for k, v in parameters.items()]
+        values += [{'ParameterKey': k, 'UsePreviousValue': True} for k in use_previous]
+        await self.__call(region, 'create_change_set', StackName=name, ChangeSetName=cs_name, Parameters=values,
+                          ChangeSetType=change_set_type, Capabilities=CAPABILITIES, **template)
+
+    async def describe_change_set(self, region, name, cs_name):
+        c = await self.__call(region, 'describe_change_set', StackName=name, ChangeSetName=cs_name)
+        return {'status': c['Status'], 'execution_status': c['ExecutionStatus'], 'reason': c.get('StatusReason', '')}
+
+    async def execute_change_set(self, region, name, cs_name):
+        await self.__call(region, 'execute_change_set', StackName=name, ChangeSetName=cs_name)
+
+    async def delete_change_set(self, region, name, cs_name):
+        await self.__call(region, 'delete_change_set', StackName=name, ChangeSetName=cs_name)
+
+
+# In-process stand-in for CloudFormation. Change sets take change_set_latency seconds to create and stacks
+# stack_latency seconds to create or update. Outputs are computed from the template: a Ref to a resource becomes
+# a fake physical id, a Ref to a parameter its value. A stack records the value of every parameter, defaults
+# included, and UsePreviousValue takes the recorded one. Stacks named in fail_stacks roll back. Every call is
+# counted in self.calls, which is what the benchmark mode reports.
+class LocalBackend(object):
+    def __init__(self, change_set_latency=0.05, stack_latency=0.2, fail_stacks=()):
+        self.change_set_latency = change_set_latency
+        self.stack_latency = stack_latency
+        self.fail_stacks = set(fail_stacks)
+        self.stacks = {}
+        self.change_sets = {}
+        self.calls = Counter()
+
+    def __now(self):
+        return asyncio.get_event_loop().time()
+
+    def __stack(self, region, name):
+        s = self.stacks.get((region, name))
+        if s and s['status'].endswith('_IN_PROGRESS') and s['status'] != 'REVIEW_IN_PROGRESS' \
+                and self.__now() >= s['ready_at']:
+            action = s['status'].split('_')[0]
+            if name in self.fail_stacks:
+                s['status'] = 'ROLLBACK_COMPLETE' if action == 'CREATE' else 'UPDATE_ROLLBACK_COMPLETE'
+                s['reason'] = 'simulated failure'
+            else:
+                s['status'] = action + '_COMPLETE'
+                s['body'], s['parameters'] = s['pending']
+                s['outputs'] = self.__outputs(name, *s['pending'])
+        return s
+
+    def __outputs(self, name, body, values):
+        template = json.loads(body)
+        outputs = {}
+        for key, output in template.get('Outputs', {}).items():
+            value = output['Value']
+            if isinstance(value, dict) and 'Ref' in value:
+                ref = value['Ref']
+                if ref in values:
+                    value = values[ref]
+                else:
+                    value = '{}-{}-{}'.format(name, ref, hashlib.sha1(body.encode('utf-8')).hexdigest()[:8]).lower()
+            outputs[key] = value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+        return outputs
+
+    async def describe_stack(self, region, name):
+        self.calls['describe_stack'] += 1
+        s = self.__stack(region, name)
+        if s is None:
+            return None
+        return {'status': s['status'], 'reason': s.get('reason', ''), 'parameters': list(s.get('parameters', {})),
+                'outputs': dict(s.get('outputs', {}))}
+
+    async def list_change_sets(self, region, name):
+        self.calls['list_change_sets'] += 1
+        return [{'name': cs_name, 'status': c['status'], 'execution_status': c['execution_status']}
+                for (r, n, cs_name), c in self.change_sets.items() if (r, n) == (region, name)]
+
+    async def create_change_set(self, region, name, cs_name, body, parameters, use_previous, change_set_type):
+        self.calls['create_change_set'] += 1
+        s = self.__stack(region, name)
+        if change_set_type == 'CREATE' and s is None:
+            s = self.stacks[(region, name)] = {'status': 'REVIEW_IN_PROGRESS', 'outputs': {}}
+        template = json.loads(body)
+        previous = s.get('parameters', {}) if change_set_type == 'UPDATE' else {}
+        values = {k: p['Default'] for k, p in template.get('Parameters', {}).items() if 'Default' in p}
+        values.update({k: previous[k] for k in use_previous if k in previous})
+        values.update(parameters)
+        missing = [k for k in template.get('Parameters', {}) if k not in values]
+        if any(k not in previous for k in use_previous):
+            status, reason = 'FAILED', 'Invalid input for parameter key {}: no previous value'.format(
+                [k for k in use_previous if k not in previous])
+        elif missing:
+            status, reason = 'FAILED', 'Parameters: {} must have values'.format(missing)
+        elif s.get('body') == body and s.get('parameters') == values:
+            status, reason = 'FAILED', "The submitted information didn't contain changes."
+        else:
+            status, reason = 'CREATE_COMPLETE', ''
+        self.change_sets[(region, name, cs_name)] = {
+            'status': 'CREATE_IN_PROGRESS', 'final': status, 'reason': reason, 'execution_status': 'UNAVAILABLE',
+            'ready_at': self.__now() + self.change_set_latency, 'body': body, 'parameters': values,
+            'type': change_set_type,
+        }
+
+    async def describe_change_set(self, region, name, cs_name):
+        self.calls['describe_change_set'] += 1
+        c = self.change_sets[(region, name, cs_name)]
+        if c['status'] == 'CREATE_IN_PROGRESS' and self.__now() >= c['ready_at']:
+            c['status'] = c['final']
+            c['execution_status'] = 'AVAILABLE' if c['status'] == 'CREATE_COMPLETE' else 'UNAVAILABLE'
+        return {'status': c['status'], 'execution_status': c['execution_status'], 'reason': c['reason']}
+
+    async def execute_change_set(self, region, name, cs_name):
+        self.calls['execute_change_set'] += 1
+        c = self.change_sets.pop((region, name, cs_name))
+        if c['execution_status'] != 'AVAILABLE':
+            raise DeployError('change set {} is not available'.format(cs_name))
+        # executing a change set deletes every other change set of the stack, as CloudFormation does
+        for key in [k for k in self.change_sets if k[:2] == (region, name)]:
+            del self.change_sets[key]
+        s = self.stacks[(region, name)]
+        s['status'] = ('CREATE' if c['type'] == 'CREATE' else 'UPDATE') + '_IN_PROGRESS'
+        s['ready_at'] = self.__now() + self.stack_latency
+        s['pending'] = (c['body'], c['parameters'])
+
+    async def delete_change_set(self, region, name, cs_name):
+        self.calls['delete_change_set'] += 1
+        self.change_sets.pop((region, name, cs_name), None)
+
+
+# Split --param values of the form env:NAME=VALUE into {env: {NAME: VALUE}}, merged over params_file (a JSON file
+# of the same shape) if given.
+def parse_env_parameters(pairs, params_file=None):
+    env_parameters = {}
+    if params_file:
+        with open(params_file, 'r') as f:
+            env_parameters = {env: dict(values) for env, values in json.load(f).items()}
+    for pair in pairs or []:
+        env, _, assignment = pair.partition(':')
+        key, equals, value = assignment.partition('=')
+        if not env or not key or not equals:
+            raise DeployError('--param {} is not env:NAME=VALUE'.format(pair))
+        env_parameters.setdefault(env, {})[key] = value
+    return env_parameters
+
+
+# The VPC and app-cluster stacks for each environment and region. VPC CIDRs come from the cidr_planner registry
+# (see cidr_planner.registry_key), so environments never overlap; the app cluster takes its VPC and subnets from the
+# outputs of its VPC stack. env_parameters ({env: {NAME: VALUE}}) sets further parameters of the environment's
+# stacks: each value goes to every stack whose template has the parameter.
+def make_stacks(envs, regions, registry, env_parameters=None):
+    env_parameters = env_parameters or {}
+    unknown_envs = set(env_parameters) - set(envs)
+    if unknown_envs:
+        raise DeployError('parameters given for environments not being deployed: ' + ', '.join(sorted(unknown_envs)))
+    vpc_names = set(make_vpc.make_template().parameters)
+    app_names = set(make_app_cluster.make_template().parameters) - set(VPC_OUTPUT_PARAMETERS)
+    for env, values in env_parameters.items():
+        unknown = sorted(set(values) - vpc_names - app_names)
+        if unknown:
+            raise DeployError('{}: no stack has parameters {}'.format(env, ', '.join(unknown)))
+
+    plans = {p.name: p for p in plan_vpcs([registry_key(e, r) for e in envs for r in regions], registry)}
+    stacks = []
+    for env in envs:
+        values = env_parameters.get(env, {})
+        for region in regions:
+            plan = plans[registry_key(env, region)]
+            vpc_stack = '{}-{}-vpc'.format(make_app_cluster.APP_NAME, env)
+            parameters = {'vpcName': '{}-{}'.format(make_app_cluster.APP_NAME, env),
+                          'lhAppTag': make_app_cluster.APP_NAME,
+                          'lhAppEnvTag': env}
+            parameters.update({k: v for k, v in values.items() if k in vpc_names})
+            stacks.append(Stack(
+                vpc_stack,
+                # bind plan now; each environment has its own CIDRs
+                lambda plan=plan: make_vpc.make_template(plan),
+                region,
+                parameters
+            ))
+
+            parameters = {key: StackOutput(region + '/' + vpc_stack, key) for key in VPC_OUTPUT_PARAMETERS}
+            parameters['lhAppEnvTag'] = env
+            parameters.update({k: v for k, v in values.items() if k in app_names})
+            stacks.append(Stack('{}-{}-app'.format(make_app_cluster.APP_NAME, env), make_app_cluster.make_template,
+                                region, parameters))
+    return stacks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Deploy VPC and app-cluster stacks concurrently')
+    parser.add_argument('--env', action='append', required=True, help='environment, e.g. dev (repeatable)')
+    parser.add_argument('--region', action='append', help='region (repeatable, default ' + DEFAULT_REGION + ')')
+    parser.add_argument('--max-parallel', type=int, default=DEFAULT_MAX_PARALLEL,
+                        help='maximum number of stacks deploying at once')
+    parser.add_argument('--registry',
+                        help='cidr_planner registry; new allocations are saved back to it (required unless --local)')
+    parser.add_argument('--param', action='append', metavar='ENV:NAME=VALUE',
+                        help='stack parameter value for an environment (repeatable)')
+    parser.add_argument('--params-file', help='JSON file of {"env": {"NAME": "VALUE"}} stack parameter values')
+    parser.add_argument('--template-bucket', help='S3 bucket for templates too large to pass inline')
+    parser.add_argument('--local', action='store_true', help='deploy to the in-process stand-in, not AWS')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='with --local: seconds per change set; stacks take 4 times as long')
+    args = parser.parse_args()
+    # without the registry every environment would be planned from scratch, and an existing VPC stack could be
+    # handed a different CIDR than the one it was created with
+    if not args.registry and not args.local:
+        parser.error('--registry is required when deploying to AWS')
+
+    registry = load_registry(args.registry)
+    try:
+        stacks = make_stacks(args.env, args.region or [DEFAULT_REGION], registry,
+                             parse_env_parameters(args.param, args.params_file))
+    except DeployError as e:
+        parser.error(str(e))
+    if args.registry:
+        save_registry(args.registry, registry)
+
+    if args.local:
+        backend = LocalBackend(args.latency, 4 * args.latency)
+        orchestrator = Orchestrator(backend, args.max_parallel, poll_initial=args.latency / 4,
+                                    poll_maximum=args.latency)
+    else:
+        backend = Boto3Backend(args.template_bucket)
+        orchestrator = Orchestrator(backend, args.max_parallel)
+
+    started = time.monotonic()
+    results = asyncio.run(orchestrator.deploy(stacks))
+    failed = False
+    for key, result in results.items():
+        if isinstance(result, Exception):
+            failed = True
+            print('{:<32} FAILED  {}'.format(key, result))
+        else:
+            print('{:<32} {:<16} {:.1f}s{}'.format(key, result.status, result.elapsed,
+                                                   ' (reused change set)' if result.reused else ''))
+    print('total {:.1f}s'.format(time.monotonic() - started))
+    if args.local:
+        print('API calls: ' + ', '.join('{}={}'.format(k, v) for k, v in sorted(backend.calls.items())))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
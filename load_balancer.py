@@ -1,13 +1,14 @@
 from troposphere import Ref, Join, Split, Select
 from troposphere.elasticloadbalancingv2 import (
     LoadBalancer, LoadBalancerAttributes, TargetGroup, Listener, ListenerRule, Action, Condition,
-    Matcher, Certificate
+    Matcher, Certificate, ForwardConfig, TargetGroupTuple
 )
 from troposphere.cloudwatch import Alarm, MetricDimension
 
 
-# make target groups for the 3 tiers
-def make_target_groups(t):
+# make target groups for the 3 tiers. Each tier in blue_green_tiers gets a second, green, target group keyed
+# tier + 'Green' (e.g. 'spaGreen' -> spaGreenTG); the original one (spaTG) is the blue target group.
+def make_target_groups(t, blue_green_tiers=()):
     def tg(name):
         return t.add_resource(TargetGroup(
             name,
@@ -27,7 +28,29 @@ def make_target_groups(t):
             ]
         ))
 
-    return {'spa': tg('spaTG'), 'api': tg('apiTG'), 'admin': tg('adminTG')}
+    target_groups = {'spa': tg('spaTG'), 'api': tg('apiTG'), 'admin': tg('adminTG')}
+    for tier in blue_green_tiers:
+        target_groups[tier + 'Green'] = tg(tier + 'GreenTG')
+    return target_groups
+
+
+# The forward action for a tier. For a blue/green tier this is a weighted forward to both target groups, with
+# the weights taken from the tier's BlueWeight and GreenWeight parameters (e.g. spaBlueWeight, spaGreenWeight).
+# blue_green.py shifts these weights during a release.
+def __forward_action(target_groups, tier):
+    if tier + 'Green' not in target_groups:
+        return Action(
+            Type="forward",
+            TargetGroupArn=Ref(target_groups[tier])
+        )
+
+    return Action(
+        Type="forward",
+        ForwardConfig=ForwardConfig(TargetGroups=[
+            TargetGroupTuple(TargetGroupArn=Ref(target_groups[tier]), Weight=Ref(tier + 'BlueWeight')),
+            TargetGroupTuple(TargetGroupArn=Ref(target_groups[tier + 'Green']), Weight=Ref(tier + 'GreenWeight'))
+        ])
+    )
 
 
 # Create a load balancer with HTTP and HTTPS listeners and target groups for SPA, API and admin instances.
@@ -61,10 +84,7 @@ def make_load_balancer(t, security_groups, target_groups):
         Port="80",
         Protocol="HTTP",
         LoadBalancerArn=Ref(alb),
-        DefaultActions=[Action(
-            Type="forward",
-            TargetGroupArn=Ref(target_groups['spa'])
-        )]
+        DefaultActions=[__forward_action(target_groups, 'spa')]
     ))
 
     t.add_resource(ListenerRule(
@@ -74,10 +94,7 @@ def make_load_balancer(t, security_groups, target_groups):
             Field="host-header",
             Values=[Join('-', ['api', Ref('AppDomain')])]
         )],
-        Actions=[Action(
-            Type="forward",
-            TargetGroupArn=Ref(target_groups['api'])
-        )],
+        Actions=[__forward_action(target_groups, 'api')],
         Priority="1"
     ))
 
@@ -88,10 +105,7 @@ def make_load_balancer(t, security_groups, target_groups):
             Field="host-header",
             Values=[Join('-', ['admin', Ref('AppDomain')])]
         )],
-        Actions=[Action(
-            Type="forward",
-            TargetGroupArn=Ref(target_groups['admin'])
-        )],
+        Actions=[__forward_action(target_groups, 'admin')],
         Priority="2"
     ))
 
@@ -100,10 +114,7 @@ def make_load_balancer(t, security_groups, target_groups):
         Port="443",
         Protocol="HTTPS",
         LoadBalancerArn=Ref(alb),
-        DefaultActions=[Action(
-            Type="forward",
-            TargetGroupArn=Ref(target_groups['spa'])
-        )],
+        DefaultActions=[__forward_action(target_groups, 'spa')],
         Certificates=[Certificate("certificate", CertificateArn=Ref('SSLCertArn'))]
     ))
 
@@ -114,10 +125,7 @@ def make_load_balancer(t, security_groups, target_groups):
             Field="host-header",
             Values=[Join('-', ['api', Ref('AppDomain')])]
         )],
-        Actions=[Action(
-            Type="forward",
-            TargetGroupArn=Ref(target_groups['api'])
-        )],
+        Actions=[__forward_action(target_groups, 'api')],
         Priority="1"
     ))
 
@@ -128,10 +136,7 @@ def make_load_balancer(t, security_groups, target_groups):
             Field="host-header",
             Values=[Join('-', ['admin', Ref('AppDomain')])]
         )],
-        Actions=[Action(
-            Type="forward",
-            TargetGroupArn=Ref(target_groups['admin'])
-        )],
+        Actions=[__forward_action(target_groups, 'admin')],
         Priority="2"
     ))
 
@@ -0,0 +1,298 @@
+# Written for Python 3
+
+# Measures how many requests per second one SPA, API or admin instance serves within our latency SLO, to pick the
+# ALBRequestCountPerTarget target for scaling, TargetResponseTimeAlarmThreshold and the instance type.
+#
+# 'run' drives an open-loop load against one target (an instance, or the stand-in below): requests are sent on a
+# fixed schedule whatever the target does, and latency is measured from the moment a request was due, so a target
+# that falls behind shows it in the percentiles instead of quietly slowing the load down. The offered rate steps
+# through a schedule; each step reports throughput, errors and latency percentiles. The Host header is the one the
+# ALB rules in load_balancer.py route on ('api-' + AppDomain for the API tier, and so on).
+#
+# The highest step that met the SLO gives the tier's recommended ALBRequestCountPerTarget, written to a JSON file
+# shared by all tiers.
+#
+# 'serve' runs a stand-in for an nginx/PHP instance: a pool of workers, each taking --service-ms per request, for
+# trying the tool out and testing it offline.
+#
+# Usage: python loadgen.py run --tier api --target 10.0.1.23:80 [--rates 10,20,50,100] [--step-seconds 30]
+#                              [--slo-ms 200] [--percentile 99] [--output capacity.json]
+#        python loadgen.py serve [--port 8080] [--workers 4] [--service-ms 20]
+
+import argparse
+import asyncio
+import json
+import os
+from collections import namedtuple
+
+# the AppDomain and TargetResponseTimeAlarmThreshold defaults of make_app_cluster.py. Copied rather than imported,
+# so this tool runs next to an instance without troposphere and awacs.
+DEFAULT_DOMAIN = 'test-friends.life-house.com'
+DEFAULT_TARGET_RESPONSE_TIME_ALARM_THRESHOLD = 0.2
+
+DEFAULT_RATES = [10, 20, 50, 100, 200]
+DEFAULT_STEP_SECONDS = 30
+DEFAULT_PERCENTILE = 99
+DEFAULT_MAX_CONNECTIONS = 256
+DEFAULT_TIMEOUT = 10.0
+
+# a step passes if its latency percentile is within the SLO, under 1% of requests failed and the target kept up
+# with at least 95% of the offered rate
+MAX_ERROR_RATE = 0.01
+MIN_THROUGHPUT_RATIO = 0.95
+
+# ALBRequestCountPerTarget is a per-minute count. Target this fraction of the measured capacity, to leave room for
+# the time it takes a scale-out to bring new instances into service.
+HEADROOM = 0.7
+
+PERCENTILES = [50, 90, 99]
+
+# offered is the scheduled rate; throughput is the number of successful responses that completed within the step,
+# per second of the step. Responses that arrive after the step ended (a target falling behind drains its queue
+# during the next step or after the last) count towards ok and the latencies, but not the throughput.
+StepResult = namedtuple('StepResult', ['offered', 'sent', 'ok', 'errors', 'throughput', 'latencies'])
+
+
+# the Host header the ALB routes on for a tier; see the host-header conditions in load_balancer.py
+def tier_host(tier, domain):
+    return domain if tier == 'spa' else tier + '-' + domain
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# Keep-alive HTTP/1.1 connections to one host and port, at most max_connections of them open at once.
+class ConnectionPool(object):
+    def __init__(self, host, port, max_connections):
+        self.host = host
+        self.port = port
+        self.idle = []
+        self.slots = asyncio.Semaphore(max_connections)
+
+    async def __read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif 'content-length' in headers:
+            await reader.readexactly(int(headers['content-length']))
+        return status, headers.get('connection', '').lower() != 'close'
+
+    async def request(self, request_bytes, timeout):
+        async with self.slots:
+            if self.idle:
+                reader, writer = self.idle.pop()
+            else:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+            try:
+                writer.write(request_bytes)
+                status, keep_alive = await asyncio.wait_for(self.__read_response(reader), timeout)
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self.idle.append((reader, writer))
+            else:
+                writer.close()
+            return status
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+
+# Send requests at each rate for step_seconds, round-robin over paths. Returns a StepResult per rate.
+async def run_schedule(host, port, host_header, paths, rates, step_seconds, max_connections=DEFAULT_MAX_CONNECTIONS,
+                       timeout=DEFAULT_TIMEOUT):
+    loop = asyncio.get_event_loop()
+    pool = ConnectionPool(host, port, max_connections)
+    requests = [('GET {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: loadgen\r\n\r\n'.format(p, host_header)).encode()
+                for p in paths]
+    outcomes = [{'ok': 0, 'in_window': 0, 'errors': 0, 'latencies': []} for _ in rates]
+    tasks = []
+
+    async def one(step, request_bytes, due, step_end):
+        try:
+            status = await pool.request(request_bytes, timeout)
+        except (OSError, asyncio.TimeoutError, ConnectionError, ValueError, IndexError,
+                asyncio.IncompleteReadError):
+            outcomes[step]['errors'] += 1
+            return
+        if status >= 500:
+            outcomes[step]['errors'] += 1
+        else:
+            now = loop.time()
+            outcomes[step]['ok'] += 1
+            outcomes[step]['latencies'].append(now - due)
+            if now <= step_end:
+                outcomes[step]['in_window'] += 1
+
+    start = loop.time()
+    sent = []
+    for step, rate in enumerate(rates):
+        count = int(rate * step_seconds)
+        for i in range(count):
+            due = start + i / float(rate)
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(one(step, requests[i % len(requests)], due, start + step_seconds)))
+        sent.append(count)
+        start += step_seconds
+        delay = start - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    await asyncio.gather(*tasks)
+    pool.close()
+    return [StepResult(rate, sent[i], outcomes[i]['ok'], outcomes[i]['errors'],
+                       outcomes[i]['in_window'] / step_seconds, sorted(outcomes[i]['latencies']))
+            for i, rate in enumerate(rates)]
+
+
+def step_passes(result, slo_seconds, p):
+    latency = percentile(result.latencies, p)
+    return (latency is not None and latency <= slo_seconds
+            and result.errors <= MAX_ERROR_RATE * result.sent
+            and result.throughput >= MIN_THROUGHPUT_RATIO * result.offered)
+
+
+# Recommended settings from a run: the highest throughput of a step that met the SLO, and the matching
+# ALBRequestCountPerTarget (requests per target per minute, with HEADROOM). None if no step met the SLO.
+def recommend(results, slo_seconds, p):
+    passing = [r for r in results if step_passes(r, slo_seconds, p)]
+    if not passing:
+        return None
+    capacity = max(r.throughput for r in passing)
+    return {
+        'max_rps_at_slo': round(capacity, 1),
+        'slo_ms': int(slo_seconds * 1000),
+        'percentile': p,
+        'ALBRequestCountPerTarget': int(round(capacity * 60 * HEADROOM)),
+    }
+
+
+def print_results(results, slo_seconds, p):
+    print('{:>8} {:>8} {:>8} {:>7} {:>9} {:>9} {:>9}  {}'.format(
+        'offered', 'tput', 'ok', 'errors', 'p50 ms', 'p90 ms', 'p99 ms', 'SLO'))
+    for r in results:
+        ms = [percentile(r.latencies, q) for q in PERCENTILES]
+        print('{:>8g} {:>8.1f} {:>8} {:>7} {:>9} {:>9} {:>9}  {}'.format(
+            r.offered, r.throughput, r.ok, r.errors,
+            *['-' if v is None else '{:.1f}'.format(v * 1000) for v in ms],
+            'ok' if step_passes(r, slo_seconds, p) else 'missed'))
+
+
+# record the tier's recommendation in the JSON file, keeping the other tiers' entries
+def write_recommendation(path, tier, recommendation):
+    data = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+    data[tier] = recommendation
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+# Stand-in for an instance: 'workers' requests are served at a time (like a PHP-FPM pool), each taking service_ms;
+# the rest queue. Answers every path with a small 200 response, keeping the connection alive.
+async def serve(port, workers, service_ms):
+    pool = asyncio.Semaphore(workers)
+    body = b'ok\n'
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                async with pool:
+                    await asyncio.sleep(service_ms / 1000.0)
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: ' +
+                             str(len(body)).encode() + b'\r\n\r\n' + body)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', port)
+    print('serving on 127.0.0.1:{} with {} workers, {} ms per request'.format(port, workers, service_ms))
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure per-instance capacity of a tier')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    run = sub.add_parser('run', help='drive load against a target')
+    run.add_argument('--tier', required=True, choices=['spa', 'api', 'admin'])
+    run.add_argument('--target', required=True, help='host:port of the instance (or stand-in)')
+    run.add_argument('--domain', default=DEFAULT_DOMAIN, help='AppDomain the Host header is derived from')
+    run.add_argument('--path', action='append', help='request path (repeatable, round-robin; default /)')
+    run.add_argument('--rates', default=','.join(map(str, DEFAULT_RATES)),
+                     help='comma-separated requests per second, one step each')
+    run.add_argument('--step-seconds', type=float, default=DEFAULT_STEP_SECONDS)
+    run.add_argument('--slo-ms', type=float, default=DEFAULT_TARGET_RESPONSE_TIME_ALARM_THRESHOLD * 1000,
+                     help='latency SLO (default: the TargetResponseTime alarm threshold)')
+    run.add_argument('--percentile', type=float, default=DEFAULT_PERCENTILE)
+    run.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS)
+    run.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='seconds before a request fails')
+    run.add_argument('--output', default='capacity.json', help='JSON file of per-tier recommendations')
+
+    stand_in = sub.add_parser('serve', help='run a local stand-in instance')
+    stand_in.add_argument('--port', type=int, default=8080)
+    stand_in.add_argument('--workers', type=int, default=4)
+    stand_in.add_argument('--service-ms', type=float, default=20)
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        try:
+            asyncio.run(serve(args.port, args.workers, args.service_ms))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    host, _, port = args.target.rpartition(':')
+    rates = [float(r) for r in args.rates.split(',')]
+    slo = args.slo_ms / 1000.0
+    results = asyncio.run(run_schedule(host, int(port), tier_host(args.tier, args.domain), args.path or ['/'],
+                                       rates, args.step_seconds, args.max_connections, args.timeout))
+    print_results(results, slo, args.percentile)
+
+    recommendation = recommend(results, slo, args.percentile)
+    if recommendation is None:
+        print('no step met the SLO; try lower rates')
+        raise SystemExit(1)
+    write_recommendation(args.output, args.tier, recommendation)
+    print('{}: {} rps at p{:g} <= {:g} ms -> ALBRequestCountPerTarget {} (written to {})'.format(
+        args.tier, recommendation['max_rps_at_slo'], args.percentile, args.slo_ms,
+        recommendation['ALBRequestCountPerTarget'], args.output))
+
+
+if __name__ == '__main__':
+    main()
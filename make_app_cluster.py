@@ -5,16 +5,25 @@
 # that creates the AMIs used here. We are using the Python troposphere library, which generates the CloudFormation
 # JSON template.
 
+import os
+
 from troposphere import Template, Parameter, Ref, Equals
+from troposphere.autoscaling import Tag
 from security_groups import make_security_groups
 from load_balancer import make_load_balancer, make_target_groups, make_load_balancer_alarms
-from autoscaling_group import make_launch_configuration, make_autoscaling_group
+from autoscaling_group import make_launch_configuration, make_autoscaling_group, make_green_autoscaling_group
 from iam import make_instance_profile
+from cache import make_cache, cache_endpoint, with_cache_endpoint
 from utils import tag_name_to_param_name
 
+# the user-data scripts live next to this file
+USER_DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
 # tweak ALL-CAPS settings here:
 APP_NAME = 'refapp'
-DEFAULT_DOMAIN = 'test-friends.life-house.com'
+DEFAULT_DOMAIN = 'test-friends.life-house.com'  # also in loadgen.py
+# VPC and subnets default to the LifeHouse default VPC; for a VPC made by make_vpc.py, pass its outputs
+# (VPC, Subnet1, Subnet2, Subnet3) as the parameters of the same name
 DEFAULT_VPC = 'vpc-93d88cfa'  # default us-east-2 VPC in LifeHouse account
 SUBNET_1 = 'subnet-12ae8a7b'  # default public subnet in us-east-2a in Lifehouse account
 SUBNET_2 = 'subnet-3626474d'  # default public subnet in us-east-2b in Lifehouse account
@@ -28,7 +37,13 @@ DEFAULT_LOGS_BUCKET = 'life-house-logs'
 DEFAULT_DB_SG = 'sg-0ce0a567'
 HEALTHCHECK_PATH = '/healthcheck'
 KEY_NAMES = [APP_NAME + '-dev-keypair', APP_NAME + '-staging-keypair', APP_NAME + '-prod-keypair', ]
-DEFAULT_TARGET_RESPONSE_TIME_ALARM_THRESHOLD = 0.2
+DEFAULT_TARGET_RESPONSE_TIME_ALARM_THRESHOLD = 0.2  # also in loadgen.py
+CACHE_NODE_TYPES = ['cache.t3.micro', 'cache.t3.small', 'cache.m5.large']
+
+# Tiers released blue/green: each gets a second (green) ASG, launch configuration and target group, and the ALB
+# forwards to both target groups by weight. See blue_green.py for shifting the weights during a release.
+BLUE_GREEN_TIERS = ['spa', 'api', 'admin']
+AMIS = {'spa': SPA_AMI_USEAST2, 'api': API_AMI_USEAST2, 'admin': ADMIN_AMI_USEAST2}
 
 SPA_ASG_TAGS = {
     'env-file': ['.env.dev', '.env.staging', '.env.prod'],
@@ -52,7 +67,7 @@ ADMIN_ASG_TAGS = {
 }
 
 
-def add_parameters(t):
+def add_parameters(t, blue_green_tiers=BLUE_GREEN_TIERS):
     t.add_parameter(Parameter(
         "AppDomain",
         Type="String",
@@ -272,6 +287,27 @@ def add_parameters(t):
         'asg_enable_metrics_collection', Equals(Ref('ASGEnableMetricsCollection'), 'True')
     )
 
+    t.add_parameter(Parameter(
+        'CreateCache',
+        Type='String',
+        Description='Create a Redis cache for API sessions, cache and queues (prod: True). Switching it replaces '
+                    'the API launch configurations; release the API tier blue/green to move instances over',
+        Default='False',
+        AllowedValues=['True', 'False']
+    ))
+
+    t.add_condition(
+        'create_cache', Equals(Ref('CreateCache'), 'True')
+    )
+
+    t.add_parameter(Parameter(
+        'CacheNodeType',
+        Type='String',
+        Description='Node type of the Redis cache (prod: cache.m5.large)',
+        Default=CACHE_NODE_TYPES[0],
+        AllowedValues=CACHE_NODE_TYPES
+    ))
+
     t.add_parameter(Parameter(
         "NotificationTopicARN",
         Type="String",
@@ -294,7 +330,13 @@ def add_parameters(t):
         AllowedValues=['test', 'dev', 'staging', 'prod']
     ))
 
-    for tier, tags in {'spa': SPA_ASG_TAGS, 'api': API_ASG_TAGS, 'admin': ADMIN_ASG_TAGS}.items():
+    # the green half of a blue/green tier has the same tags as the blue half, set through its own parameters
+    # (e.g. spaGreenRepoBranch), so the two halves can run different code
+    asg_tags = {'spa': SPA_ASG_TAGS, 'api': API_ASG_TAGS, 'admin': ADMIN_ASG_TAGS}
+    for tier in blue_green_tiers:
+        asg_tags[tier + 'Green'] = asg_tags[tier]
+
+    for tier, tags in asg_tags.items():
         for key in tags:
             v = tags[key]
             if isinstance(v, (list,)):
@@ -314,21 +356,99 @@ def add_parameters(t):
                 ))
 
 
-def main():
+# Parameters of the green half of each blue/green tier, and the ALB weights of both halves. The green ASG is
+# empty by default; size it up (and point its AMI or repo-branch at the new release) before shifting weight to it.
+def add_blue_green_parameters(t, blue_green_tiers=BLUE_GREEN_TIERS):
+    for tier in blue_green_tiers:
+        green = tier + 'Green'
+
+        t.add_parameter(Parameter(
+            green + "AMI",
+            Type="String",
+            Description="AMI to use for the green half of the " + tier + " tier",
+            Default=AMIS[tier],
+        ))
+
+        t.add_parameter(Parameter(
+            green + "HealthcheckGracePeriod",
+            Type="Number",
+            Default=300,
+            Description="How long the ASG waits to start health-checking green " + tier + " instances"
+        ))
+
+        t.add_parameter(Parameter(
+            green + "InitialASGSize",
+            Type="Number",
+            Default=0,
+            Description="Initial size of the green " + tier + " autoscaling group (match blue before a release)"
+        ))
+
+        t.add_parameter(Parameter(
+            green + "MinASGSize",
+            Type="Number",
+            Default=0,
+            Description="Minimum size of the green " + tier + " autoscaling group"
+        ))
+
+        t.add_parameter(Parameter(
+            green + "MaxASGSize",
+            Type="Number",
+            Default=1,
+            Description="Maximum size of the green " + tier + " autoscaling group (prod: 6)"
+        ))
+
+        t.add_parameter(Parameter(
+            tier + "BlueWeight",
+            Type="Number",
+            Default=100,
+            MinValue=0,
+            MaxValue=999,
+            Description="Share of " + tier + " requests the ALB sends to the blue target group"
+        ))
+
+        t.add_parameter(Parameter(
+            tier + "GreenWeight",
+            Type="Number",
+            Default=0,
+            MinValue=0,
+            MaxValue=999,
+            Description="Share of " + tier + " requests the ALB sends to the green target group"
+        ))
+
+
+def __read(directory, file_name):
+    with open(os.path.join(directory, file_name), 'r') as f:
+        return f.read()
+
+
+# settings may override:
+#   'user_data_dir' - directory holding user_data_spa.sh and user_data_api.sh (default: next to this file)
+#   'blue_green_tiers' - tiers with a green ASG and target group (default: BLUE_GREEN_TIERS)
+def make_template(settings=None):
+    settings = settings or {}
+    user_data_dir = settings.get('user_data_dir', USER_DATA_DIR)
+    blue_green_tiers = settings.get('blue_green_tiers', BLUE_GREEN_TIERS)
+
     t = Template()
     t.add_version("2010-09-09")
     t.add_description("Creates a LifeHouse app cluster")
 
-    add_parameters(t)
+    add_parameters(t, blue_green_tiers)
+    add_blue_green_parameters(t, blue_green_tiers)
 
     security_groups = make_security_groups(t)
-    target_groups = make_target_groups(t)
+    target_groups = make_target_groups(t, blue_green_tiers)
     alb = make_load_balancer(t, [security_groups['alb']], target_groups)
     make_load_balancer_alarms(t, alb, target_groups)
 
+    cache = make_cache(t, security_groups['cache'])
+
+    # API instances find the cache through this tag; see user_data_api.sh
+    api_extra_tags = [Tag('cache-endpoint', cache_endpoint(cache), True)]
+
     instance_profile = make_instance_profile(t)
-    spa_user_data = open('user_data_spa.sh', 'r').read()
-    api_user_data = open('user_data_api.sh', 'r').read()
+    spa_user_data = __read(user_data_dir, 'user_data_spa.sh')
+    api_user_data = with_cache_endpoint(__read(user_data_dir, 'user_data_api.sh'), cache)
 
     spa_lc = make_launch_configuration(t, 'spa', [security_groups['spa']], spa_user_data, instance_profile)
 
@@ -336,14 +456,34 @@ def main():
     admin_lc = make_launch_configuration(t, 'admin', [security_groups['admin']], spa_user_data, instance_profile)
 
     # API instances must also join the DB security group
-    api_lc = make_launch_configuration(t, 'api', [security_groups['api'], 'DatabaseSG'], api_user_data,
-                                       instance_profile)
+    api_security_groups = [security_groups['api'], 'DatabaseSG']
+    api_lc = make_launch_configuration(t, 'api', api_security_groups, api_user_data, instance_profile)
 
     make_autoscaling_group(t, 'spa', spa_lc, target_groups['spa'], SPA_ASG_TAGS.keys())
-    make_autoscaling_group(t, 'api', api_lc, target_groups['api'], API_ASG_TAGS.keys())
+    make_autoscaling_group(t, 'api', api_lc, target_groups['api'], API_ASG_TAGS.keys(), api_extra_tags)
     make_autoscaling_group(t, 'admin', admin_lc, target_groups['admin'], ADMIN_ASG_TAGS.keys())
 
-    print(t.to_json())
+    # the green half of a tier is launched exactly like the blue half
+    tiers = {
+        'spa': ([security_groups['spa']], spa_user_data, SPA_ASG_TAGS, []),
+        'api': (api_security_groups, api_user_data, API_ASG_TAGS, api_extra_tags),
+        'admin': ([security_groups['admin']], spa_user_data, ADMIN_ASG_TAGS, []),
+    }
+    for tier in blue_green_tiers:
+        tier_security_groups, user_data, tags, extra_tags = tiers[tier]
+        make_green_autoscaling_group(t, tier, tier_security_groups, user_data, instance_profile, target_groups,
+                                     tags.keys(), extra_tags)
+
+    return t
+
+
+# Library entry point for pipelines and watch.py: the app-cluster template as a dict (see make_template for settings)
+def build_app_cluster(settings=None):
+    return make_template(settings).to_dict()
+
+
+def main():
+    print(make_template().to_json())
 
 
 if __name__ == '__main__':
@@ -1,11 +1,21 @@
-from troposphere import Template, Parameter, Ref, GetAZs, Select
+import argparse
+
+from troposphere import Template, Parameter, Ref, GetAZs, Select, Output, Export, Sub, Equals, GetAtt
 from troposphere.ec2 import VPC, Subnet, InternetGateway, VPCGatewayAttachment, RouteTable, Route, \
-    SubnetRouteTableAssociation
+    SubnetRouteTableAssociation, SecurityGroup, SecurityGroupRule, VPCEndpoint
+from cidr_planner import plan_vpc, plan_vpcs, load_registry, save_registry, registry_key
 
 VPC_CIDRBLOCK = "10.0.0.0/16"
-SUBNET_A_CIDRBLOCK = "10.0.1.0/24"
-SUBNET_B_CIDRBLOCK = "10.0.2.0/24"
-SUBNET_C_CIDRBLOCK = "10.0.3.0/24"
+AZ_COUNT = 3
+
+# AWS services reached through interface endpoints when CreateVPCEndpoints is True: the EC2 API (describe-tags in
+# the user-data scripts), CloudWatch metrics and logs, and SSM. S3 gets a gateway endpoint instead.
+INTERFACE_ENDPOINT_SERVICES = {
+    'EC2': 'ec2',
+    'CloudWatch': 'monitoring',
+    'CloudWatchLogs': 'logs',
+    'SSM': 'ssm',
+}
 
 
 def add_parameters(t):
@@ -30,13 +40,27 @@ def add_parameters(t):
         Default="prod"
     ))
 
+    t.add_parameter(Parameter(
+        "CreateVPCEndpoints",
+        Type="String",
+        Description="Create an S3 gateway endpoint and interface endpoints for EC2, CloudWatch, CloudWatch Logs "
+                    "and SSM, so AWS API traffic stays off the internet gateway (prod: True)",
+        Default="False",
+        AllowedValues=["True", "False"]
+    ))
+
+    t.add_condition(
+        'create_vpc_endpoints', Equals(Ref('CreateVPCEndpoints'), 'True')
+    )
 
-def __make_subnet(t, vpc, route_table, subnet_name, cidr_block):
+
+def __make_subnet(t, vpc, route_table, subnet_plan):
+    subnet_name = subnet_plan.name
     subnet = t.add_resource(Subnet(
         subnet_name,
         VpcId=Ref(vpc),
-        CidrBlock=cidr_block,
-        AvailabilityZone=Select(0, GetAZs(Ref("AWS::Region"))),
+        CidrBlock=subnet_plan.cidr,
+        AvailabilityZone=Select(subnet_plan.az_index, GetAZs(Ref("AWS::Region"))),
         Tags=[
             {'Key': 'lh-app', 'Value': Ref('lhAppTag')},
             {'Key': 'lh-app-env', 'Value': Ref('lhAppEnvTag')},
@@ -49,12 +73,29 @@ def __make_subnet(t, vpc, route_table, subnet_name, cidr_block):
         RouteTableId=Ref(route_table)
     ))
 
+    return subnet
+
+
+# export a value under '<stack name>-<name>'. Output names match the make_app_cluster parameters they feed
+# (VPC, Subnet1, Subnet2, ...), so the outputs of this stack can be passed straight through as parameters.
+def __add_output(t, name, description, value):
+    t.add_output(Output(
+        name,
+        Description=description,
+        Value=value,
+        Export=Export(Sub('${AWS::StackName}-' + name))
+    ))
+
 
-# create a VPC with 3 public subnets, route-table and internet gateway
-def make_vpc(t):
+# create a VPC with a public and a private subnet in each AZ of the plan (see cidr_planner.py), an internet gateway,
+# a public route-table with a route to the internet and a private route-table without one
+def make_vpc(t, plan):
     vpc = t.add_resource(VPC(
         "VPC",
-        CidrBlock=VPC_CIDRBLOCK,
+        CidrBlock=plan.cidr,
+        # both are required for the private DNS names of interface endpoints to resolve inside the VPC
+        EnableDnsSupport=True,
+        EnableDnsHostnames=True,
         Tags=[
             {'Key': 'lh-app', 'Value': Ref('lhAppTag')},
             {'Key': 'lh-app-env', 'Value': Ref('lhAppEnvTag')},
@@ -92,18 +133,123 @@ def make_vpc(t):
         DependsOn=igw_attachment.title
     ))
 
-    __make_subnet(t, vpc, route_table, "SubnetA", SUBNET_A_CIDRBLOCK)
-    __make_subnet(t, vpc, route_table, "SubnetB", SUBNET_B_CIDRBLOCK)
-    __make_subnet(t, vpc, route_table, "SubnetC", SUBNET_C_CIDRBLOCK)
+    private_route_table = t.add_resource(RouteTable(
+        "PrivateRouteTable",
+        VpcId=Ref(vpc),
+        Tags=[
+            {'Key': 'lh-app', 'Value': Ref('lhAppTag')},
+            {'Key': 'lh-app-env', 'Value': Ref('lhAppEnvTag')},
+        ]
+    ))
 
+    public_subnets = [__make_subnet(t, vpc, route_table, s) for s in plan.public]
+    private_subnets = [__make_subnet(t, vpc, private_route_table, s) for s in plan.private]
 
-def main():
+    __add_output(t, 'VPC', 'VPC id', Ref(vpc))
+    for i, subnet in enumerate(public_subnets):
+        __add_output(t, 'Subnet' + str(i + 1), 'Public subnet in AZ ' + str(i), Ref(subnet))
+    for i, subnet in enumerate(private_subnets):
+        __add_output(t, 'PrivateSubnet' + str(i + 1), 'Private subnet in AZ ' + str(i), Ref(subnet))
+
+    return {'vpc': vpc, 'public_route_table': route_table, 'private_route_table': private_route_table,
+            'public_subnets': public_subnets, 'private_subnets': private_subnets}
+
+
+# Create VPC endpoints so calls to AWS services go over the AWS network instead of out through the internet gateway.
+# S3 uses a (free) gateway endpoint, which adds a route to both route tables. The other services use interface
+# endpoints: an ENI in each private subnet, reachable on 443 from anywhere in the VPC. With private DNS enabled the
+# regular service hostnames (e.g. ec2.us-east-2.amazonaws.com) resolve to those ENIs from every subnet, public
+# ones included, so the AWS CLI on the instances needs no configuration change.
+# All of these resources are created only when the CreateVPCEndpoints parameter is True.
+def make_vpc_endpoints(t, vpc_resources, plan):
+    vpc = vpc_resources['vpc']
+
+    sg = t.add_resource(SecurityGroup(
+        "VPCEndpointSG",
+        Condition='create_vpc_endpoints',
+        GroupDescription='Enable HTTPS to interface VPC endpoints from within the VPC',
+        VpcId=Ref(vpc),
+        SecurityGroupIngress=[
+            SecurityGroupRule(
+                IpProtocol="tcp",
+                FromPort="443",
+                ToPort="443",
+                CidrIp=plan.cidr
+            )
+        ],
+        Tags=[
+            {'Key': 'lh-app', 'Value': Ref('lhAppTag')},
+            {'Key': 'lh-app-env', 'Value': Ref('lhAppEnvTag')},
+        ]
+    ))
+
+    t.add_resource(VPCEndpoint(
+        "S3Endpoint",
+        Condition='create_vpc_endpoints',
+        VpcId=Ref(vpc),
+        ServiceName=Sub('com.amazonaws.${AWS::Region}.s3'),
+        VpcEndpointType='Gateway',
+        RouteTableIds=[Ref(vpc_resources['public_route_table']), Ref(vpc_resources['private_route_table'])]
+    ))
+
+    for name, service in INTERFACE_ENDPOINT_SERVICES.items():
+        t.add_resource(VPCEndpoint(
+            name + "Endpoint",
+            Condition='create_vpc_endpoints',
+            VpcId=Ref(vpc),
+            ServiceName=Sub('com.amazonaws.${AWS::Region}.' + service),
+            VpcEndpointType='Interface',
+            PrivateDnsEnabled=True,
+            SubnetIds=[Ref(s) for s in vpc_resources['private_subnets']],
+            SecurityGroupIds=[GetAtt(sg, 'GroupId')]
+        ))
+
+
+# plan is a cidr_planner.VpcPlan; by default the VPC_CIDRBLOCK layout over AZ_COUNT availability zones
+def make_template(plan=None):
+    plan = plan or plan_vpc('vpc', VPC_CIDRBLOCK, AZ_COUNT)
     t = Template()
     t.add_version("2010-09-09")
-    t.add_description("Create a VPC with 3 public subnets")
+    t.add_description("Create a VPC with public and private subnets in " + str(len(plan.public)) +
+                      " availability zones")
     add_parameters(t)
-    make_vpc(t)
-    print(t.to_json())
+    vpc_resources = make_vpc(t, plan)
+    make_vpc_endpoints(t, vpc_resources, plan)
+    return t
+
+
+# Library entry point for pipelines and watch.py: the VPC template as a dict. settings may set 'cidr' and
+# 'az_count' (default VPC_CIDRBLOCK and AZ_COUNT), or a ready-made cidr_planner 'plan'.
+def build_vpc(settings=None):
+    settings = settings or {}
+    plan = settings.get('plan') or plan_vpc('vpc', settings.get('cidr', VPC_CIDRBLOCK),
+                                            settings.get('az_count', AZ_COUNT))
+    return make_template(plan).to_dict()
+
+
+# With --registry and --env, the VPC CIDR of the environment in --region comes from the cidr_planner registry (a
+# new environment is allocated a free block and saved to the registry), so every environment's template gets its
+# own non-overlapping CIDR. The registry entry is the one deploy.py uses for the same environment and region.
+def main():
+    from deploy import DEFAULT_REGION  # deploy.py imports this module
+
+    parser = argparse.ArgumentParser(description='Generate the VPC CloudFormation template')
+    parser.add_argument('--registry', help='cidr_planner JSON registry of environments and their VPC CIDRs')
+    parser.add_argument('--env', help='environment to take the VPC CIDR from, e.g. dev')
+    parser.add_argument('--region', default=DEFAULT_REGION, help='region the stack is deployed to')
+    args = parser.parse_args()
+    if bool(args.registry) != bool(args.env):
+        parser.error('--registry and --env go together')
+
+    plan = None
+    if args.registry:
+        registry = load_registry(args.registry)
+        key = registry_key(args.env, args.region)
+        known = key in registry
+        plan = plan_vpcs([key], registry, AZ_COUNT)[0]
+        if not known:
+            save_registry(args.registry, registry)
+    print(make_template(plan).to_json())
 
 
 if __name__ == '__main__':
@@ -6,6 +6,8 @@ from troposphere.ec2 import SecurityGroup, SecurityGroupRule
 # - The load-balancer is in a SG that allows HTTP and HTTPS from anywhere.
 # - EC2 instances in the SPA, admin and API autoscaling groups are in respective SGs that allow HTTP from the ALB.
 # - API instances are additionally in the existing DatabaseSG - see the comment in main().
+# - The optional Redis cache is in a SG that allows Redis from the API instances only. The email queue worker
+#   runs on the API instances, so this covers it too.
 
 def __make_alb_security_group(t):
     sg = t.add_resource(SecurityGroup(
@@ -71,9 +73,35 @@ def __make_ec2_security_group(t, tier, alb_sg):
     return sg
 
 
+# make a security group for the cache (only when the CreateCache parameter is True),
+# reachable on the Redis port from the given client security groups
+def __make_cache_security_group(t, client_sgs):
+    sg = t.add_resource(SecurityGroup(
+        "cacheSG",
+        Condition='create_cache',
+        GroupDescription='Enable Redis from API instances',
+        VpcId=Ref('VPC'),
+        SecurityGroupIngress=[
+            SecurityGroupRule(
+                IpProtocol="tcp",
+                FromPort="6379",
+                ToPort="6379",
+                SourceSecurityGroupId=GetAtt(client_sg, "GroupId")
+            ) for client_sg in client_sgs
+        ],
+        Tags=[
+            {'Key': 'lh-app', 'Value': Ref('lhAppTag')},
+            {'Key': 'lh-app-env', 'Value': Ref('lhAppEnvTag')}
+        ]
+    ))
+
+    return sg
+
+
 def make_security_groups(t):
     alb_sg = __make_alb_security_group(t)
     spa_sg = __make_ec2_security_group(t, 'spa', alb_sg)
     api_sg = __make_ec2_security_group(t, 'api', alb_sg)
     admin_sg = __make_ec2_security_group(t, 'admin', alb_sg)
-    return {'alb': alb_sg, 'spa': spa_sg, 'api': api_sg, 'admin': admin_sg}
+    cache_sg = __make_cache_security_group(t, [api_sg])
+    return {'alb': alb_sg, 'spa': spa_sg, 'api': api_sg, 'admin': admin_sg, 'cache': cache_sg}
@@ -0,0 +1,418 @@
+# Written for Python 3
+
+# Semantic diff of two generated CloudFormation templates (local JSON files), e.g. last release's app_cluster.json
+# against the one we are about to deploy. Each changed resource is classified as no-interruption, some-interruption
+# or replacement using the UPDATE_BEHAVIORS table below, and we estimate how many instances each ASG will cycle.
+# The point is to catch accidental fleet rollovers (any edit to a launch configuration, including its user-data,
+# replaces the *LC) before they reach CloudFormation.
+#
+# Conditions are evaluated with each template's parameter values, so flipping a parameter such as CreateCache
+# shows up as the resources it guards being added or removed, and Fn::If picks the branch CloudFormation would.
+#
+# Usage: python template_diff.py old.json new.json [--old-param CreateCache=False ...]
+#                                [--new-param CreateCache=True ...] [--fail-on replacement]
+
+import argparse
+import json
+import re
+import sys
+from collections import namedtuple
+
+NO_INTERRUPTION = 'no-interruption'
+SOME_INTERRUPTION = 'some-interruption'
+REPLACEMENT = 'replacement'
+SEVERITY = {NO_INTERRUPTION: 0, SOME_INTERRUPTION: 1, REPLACEMENT: 2}
+
+# Update behavior of each property of the resource types our builders emit, taken from the "Update requires"
+# line of each property in the CloudFormation resource reference. '*' is the behavior of any property that is
+# not listed. Where the docs say "conditional" we record the worst case. Add types here as the builders grow;
+# unknown types are treated as replacement so the differ errs on the side of caution.
+UPDATE_BEHAVIORS = {
+    'AWS::AutoScaling::AutoScalingGroup': {
+        '*': NO_INTERRUPTION,
+        'AutoScalingGroupName': REPLACEMENT,
+        'InstanceId': REPLACEMENT,
+        'VPCZoneIdentifier': SOME_INTERRUPTION,
+    },
+    'AWS::AutoScaling::LaunchConfiguration': {'*': REPLACEMENT},
+    'AWS::AutoScaling::ScalingPolicy': {'*': NO_INTERRUPTION},
+    'AWS::CloudWatch::Alarm': {'*': NO_INTERRUPTION, 'AlarmName': REPLACEMENT},
+    'AWS::EC2::InternetGateway': {'*': NO_INTERRUPTION},
+    'AWS::EC2::Route': {'*': NO_INTERRUPTION, 'DestinationCidrBlock': REPLACEMENT, 'RouteTableId': REPLACEMENT},
+    'AWS::EC2::RouteTable': {'*': NO_INTERRUPTION, 'VpcId': REPLACEMENT},
+    'AWS::EC2::SecurityGroup': {
+        '*': NO_INTERRUPTION,
+        'GroupDescription': REPLACEMENT,
+        'GroupName': REPLACEMENT,
+        'VpcId': REPLACEMENT,
+    },
+    'AWS::EC2::Subnet': {
+        '*': NO_INTERRUPTION,
+        'AvailabilityZone': REPLACEMENT,
+        'AvailabilityZoneId': REPLACEMENT,
+        'CidrBlock': REPLACEMENT,
+        'VpcId': REPLACEMENT,
+    },
+    'AWS::EC2::SubnetRouteTableAssociation': {'*': NO_INTERRUPTION, 'SubnetId': REPLACEMENT},
+    'AWS::EC2::VPC': {'*': NO_INTERRUPTION, 'CidrBlock': REPLACEMENT, 'InstanceTenancy': REPLACEMENT},
+    'AWS::EC2::VPCEndpoint': {
+        '*': NO_INTERRUPTION,
+        'ServiceName': REPLACEMENT,
+        'VpcEndpointType': REPLACEMENT,
+        'VpcId': REPLACEMENT,
+    },
+    'AWS::EC2::VPCGatewayAttachment': {'*': SOME_INTERRUPTION, 'VpcId': REPLACEMENT},
+    'AWS::ElastiCache::ReplicationGroup': {
+        '*': NO_INTERRUPTION,
+        'AtRestEncryptionEnabled': REPLACEMENT,
+        'CacheSubnetGroupName': REPLACEMENT,
+        'Engine': REPLACEMENT,
+        'KmsKeyId': REPLACEMENT,
+        'Port': REPLACEMENT,
+        'ReplicationGroupId': REPLACEMENT,
+        'TransitEncryptionEnabled': REPLACEMENT,
+    },
+    'AWS::ElastiCache::SubnetGroup': {'*': NO_INTERRUPTION, 'CacheSubnetGroupName': REPLACEMENT},
+    'AWS::ElasticLoadBalancingV2::Listener': {'*': NO_INTERRUPTION, 'LoadBalancerArn': REPLACEMENT},
+    'AWS::ElasticLoadBalancingV2::ListenerRule': {'*': NO_INTERRUPTION, 'ListenerArn': REPLACEMENT},
+    'AWS::ElasticLoadBalancingV2::LoadBalancer': {
+        '*': NO_INTERRUPTION,
+        'Name': REPLACEMENT,
+        'Scheme': REPLACEMENT,
+        'Type': REPLACEMENT,
+    },
+    'AWS::ElasticLoadBalancingV2::TargetGroup': {
+        '*': NO_INTERRUPTION,
+        'Name': REPLACEMENT,
+        'Port': REPLACEMENT,
+        'Protocol': REPLACEMENT,
+        'ProtocolVersion': REPLACEMENT,
+        'TargetType': REPLACEMENT,
+        'VpcId': REPLACEMENT,
+    },
+    'AWS::IAM::InstanceProfile': {'*': NO_INTERRUPTION, 'InstanceProfileName': REPLACEMENT, 'Path': REPLACEMENT},
+    'AWS::IAM::Policy': {'*': NO_INTERRUPTION},
+    'AWS::IAM::Role': {'*': NO_INTERRUPTION, 'Path': REPLACEMENT, 'RoleName': REPLACEMENT},
+}
+
+ASG_TYPE = 'AWS::AutoScaling::AutoScalingGroup'
+
+# action is 'add', 'remove' or 'modify'. properties maps each changed property name to its behavior; reasons
+# says why a property counts as changed when its literal value did not (a referenced resource was replaced, or a
+# referenced parameter has a different value).
+Change = namedtuple('Change', ['logical_id', 'resource_type', 'action', 'behavior', 'properties', 'reasons'])
+
+# instance churn for one ASG: 'replaced' instances are cycled by this deploy, 'stale' ones keep running on the
+# previous launch configuration until the ASG next replaces them (scale-in, health check, manual refresh).
+Churn = namedtuple('Churn', ['asg', 'capacity', 'replaced', 'stale', 'reason'])
+
+SUB_REFERENCE = re.compile(r'\$\{([A-Za-z0-9:]+)(\.[A-Za-z0-9.]+)?\}')
+
+# stands for Ref AWS::NoValue while resolving Fn::If; the property or list item holding it is dropped
+NO_VALUE = object()
+
+
+def load_template(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def property_behavior(resource_type, prop):
+    behaviors = UPDATE_BEHAVIORS.get(resource_type, {'*': REPLACEMENT})
+    return behaviors.get(prop, behaviors['*'])
+
+
+def worst(behaviors):
+    return max(behaviors, key=lambda b: SEVERITY[b], default=NO_INTERRUPTION)
+
+
+# collect the logical ids (resources or parameters) that a property value refers to
+def references(value):
+    found = set()
+    if isinstance(value, dict):
+        for key, v in value.items():
+            if key == 'Ref' and isinstance(v, str):
+                found.add(v)
+            elif key == 'Fn::GetAtt':
+                found.add(v[0] if isinstance(v, list) else v.split('.')[0])
+            elif key == 'Fn::Sub':
+                text = v[0] if isinstance(v, list) else v
+                found.update(m.group(1) for m in SUB_REFERENCE.finditer(text))
+                if isinstance(v, list):
+                    found.update(references(v[1]))
+            else:
+                found.update(references(v))
+    elif isinstance(value, list):
+        for v in value:
+            found.update(references(v))
+    return found
+
+
+# The value each parameter will have at deploy time: its Default, unless overridden. Values are compared as
+# strings, the way CloudFormation passes them, so a Number Default of 1 equals an override of '1'. Raises
+# ValueError for an override that is not a parameter of the template.
+def parameter_values(template, overrides=None):
+    parameters = template.get('Parameters', {})
+    unknown = sorted(set(overrides or {}) - set(parameters))
+    if unknown:
+        raise ValueError('not parameters of the template: ' + ', '.join(unknown))
+    values = {name: p.get('Default') for name, p in parameters.items()}
+    values.update(overrides or {})
+    return {name: None if value is None else str(value) for name, value in values.items()}
+
+
+# Evaluate the template's Conditions with the given parameter values. Returns {condition name: bool}.
+# Pseudo parameters (AWS::Region etc.) compare by name, which is all a diff of one stack needs.
+def evaluate_conditions(template, values):
+    definitions = template.get('Conditions', {})
+    results = {}
+
+    def operand(value):
+        if isinstance(value, dict) and 'Ref' in value:
+            name = value['Ref']
+            return str(values[name]) if name in values else name
+        if isinstance(value, dict):
+            return value
+        return str(value)
+
+    def evaluate(value):
+        if isinstance(value, dict):
+            if 'Condition' in value:
+                return condition(value['Condition'])
+            if 'Fn::Equals' in value:
+                a, b = value['Fn::Equals']
+                return operand(a) == operand(b)
+            if 'Fn::Not' in value:
+                return not evaluate(value['Fn::Not'][0])
+            if 'Fn::And' in value:
+                return all(evaluate(v) for v in value['Fn::And'])
+            if 'Fn::Or' in value:
+                return any(evaluate(v) for v in value['Fn::Or'])
+        raise ValueError('cannot evaluate condition {!r}'.format(value))
+
+    def condition(name):
+        if name not in results:
+            results[name] = evaluate(definitions[name])
+        return results[name]
+
+    for name in definitions:
+        condition(name)
+    return results
+
+
+# a value with every Fn::If replaced by the branch its condition selects, and AWS::NoValue dropped
+def resolve(value, conditions):
+    if isinstance(value, dict):
+        if value == {'Ref': 'AWS::NoValue'}:
+            return NO_VALUE
+        if 'Fn::If' in value:
+            name, if_true, if_false = value['Fn::If']
+            return resolve(if_true if conditions[name] else if_false, conditions)
+        resolved = {key: resolve(v, conditions) for key, v in value.items()}
+        return {key: v for key, v in resolved.items() if v is not NO_VALUE}
+    if isinstance(value, list):
+        return [v for v in (resolve(v, conditions) for v in value) if v is not NO_VALUE]
+    return value
+
+
+# the resources CloudFormation would create for these parameter values (their Condition, if any, is true), with
+# Fn::If resolved
+def active_resources(template, values):
+    conditions = evaluate_conditions(template, values)
+    resources = template.get('Resources', {})
+    return {logical_id: resolve(resource, conditions) for logical_id, resource in resources.items()
+            if conditions.get(resource.get('Condition'), True)}
+
+
+# why a resource that is in the template is not created, e.g. 'condition create_cache is false in the new
+# template (CreateCache=False)'; empty if the resource is not in the template at all
+def __condition_reason(template, logical_id, values, which):
+    condition = template.get('Resources', {}).get(logical_id, {}).get('Condition')
+    if condition is None:
+        return []
+    params = sorted(references(template['Conditions'][condition]) & set(values))
+    return ['condition {} is false in the {} template ({})'.format(
+        condition, which, ', '.join(name + '=' + str(values[name]) for name in params))]
+
+
+def __direct_changes(old_res, new_res):
+    changed = set()
+    old_props = old_res.get('Properties', {})
+    new_props = new_res.get('Properties', {})
+    for prop in set(old_props) | set(new_props):
+        if old_props.get(prop) != new_props.get(prop):
+            changed.add(prop)
+    return changed
+
+
+# Diff two templates. Returns a list of Change, one per resource that is added, removed or modified.
+# Only resources whose Condition holds for the template's parameter values are compared, so a condition that
+# flips reads as an add or a remove. Replacements propagate: a property that Refs (or GetAtts) a replaced resource
+# gets a new value, so the resource holding it is updated too, possibly replaced in turn (e.g. a new VPC replaces
+# every subnet).
+def diff_templates(old, new, old_params=None, new_params=None):
+    old_values = parameter_values(old, old_params)
+    new_values = parameter_values(new, new_params)
+    old_resources = active_resources(old, old_values)
+    new_resources = active_resources(new, new_values)
+    changed_params = {name for name in set(old_values) | set(new_values)
+                      if old_values.get(name) != new_values.get(name)}
+
+    changes = {}
+    for logical_id in old_resources.keys() - new_resources.keys():
+        changes[logical_id] = Change(logical_id, old_resources[logical_id]['Type'], 'remove', REPLACEMENT, {},
+                                     __condition_reason(new, logical_id, new_values, 'new'))
+    for logical_id in new_resources.keys() - old_resources.keys():
+        changes[logical_id] = Change(logical_id, new_resources[logical_id]['Type'], 'add', NO_INTERRUPTION, {},
+                                     __condition_reason(old, logical_id, old_values, 'old'))
+
+    common = sorted(old_resources.keys() & new_resources.keys())
+    props = {logical_id: {} for logical_id in common}
+    reasons = {logical_id: [] for logical_id in common}
+    for logical_id in common:
+        old_res, new_res = old_resources[logical_id], new_resources[logical_id]
+        if old_res['Type'] != new_res['Type']:
+            props[logical_id]['Type'] = REPLACEMENT
+            continue
+        for prop in __direct_changes(old_res, new_res):
+            props[logical_id][prop] = property_behavior(new_res['Type'], prop)
+        for attr in ('UpdatePolicy', 'DependsOn', 'Metadata', 'Condition', 'DeletionPolicy'):
+            if old_res.get(attr) != new_res.get(attr):
+                props[logical_id][attr] = NO_INTERRUPTION
+        for prop, value in new_res.get('Properties', {}).items():
+            params = references(value) & changed_params
+            if params and prop not in props[logical_id]:
+                props[logical_id][prop] = property_behavior(new_res['Type'], prop)
+                reasons[logical_id].append(prop + ' uses changed parameter ' + ', '.join(sorted(params)))
+
+    # propagate replacements until nothing new is replaced
+    replaced = {lid for lid, c in changes.items() if c.action == 'remove'}
+    replaced |= {lid for lid in common if worst(props[lid].values()) == REPLACEMENT}
+    pending = set(replaced)
+    while pending:
+        newly_replaced = set()
+        for logical_id in common:
+            if logical_id in replaced:
+                continue
+            resource = new_resources[logical_id]
+            for prop, value in resource.get('Properties', {}).items():
+                hit = references(value) & pending
+                if not hit:
+                    continue
+                behavior = property_behavior(resource['Type'], prop)
+                props[logical_id][prop] = worst([behavior, props[logical_id].get(prop, NO_INTERRUPTION)])
+                reasons[logical_id].append(prop + ' references replaced ' + ', '.join(sorted(hit)))
+                if behavior == REPLACEMENT:
+                    newly_replaced.add(logical_id)
+        replaced |= newly_replaced
+        pending = newly_replaced
+
+    for logical_id in common:
+        if props[logical_id]:
+            changes[logical_id] = Change(logical_id, new_resources[logical_id]['Type'], 'modify',
+                                         worst(props[logical_id].values()), props[logical_id], reasons[logical_id])
+
+    return sorted(changes.values(), key=lambda c: (-SEVERITY[c.behavior], c.logical_id))
+
+
+def __capacity(resource, values):
+    desired = resource.get('Properties', {}).get('DesiredCapacity',
+                                                 resource.get('Properties', {}).get('MinSize', 0))
+    if isinstance(desired, dict) and 'Ref' in desired:
+        desired = values.get(desired['Ref'], 0)
+    try:
+        return int(desired)
+    except (TypeError, ValueError):
+        return 0
+
+
+def __has_rolling_update(resource):
+    policy = resource.get('UpdatePolicy', {})
+    return 'AutoScalingRollingUpdate' in policy or 'AutoScalingReplacingUpdate' in policy
+
+
+# Estimate instance churn per ASG, given the changes returned by diff_templates().
+# Without an UpdatePolicy, a new launch configuration does not cycle running instances; they are reported as
+# stale instead, since they roll over the first time the ASG scales in or replaces an unhealthy instance.
+def estimate_churn(old, new, changes, old_params=None, new_params=None):
+    by_id = {c.logical_id: c for c in changes}
+    old_values = parameter_values(old, old_params)
+    new_values = parameter_values(new, new_params)
+    churn = []
+    for logical_id, change in sorted(by_id.items()):
+        if change.resource_type != ASG_TYPE:
+            continue
+        if change.action == 'add':
+            capacity = __capacity(new['Resources'][logical_id], new_values)
+            churn.append(Churn(logical_id, capacity, 0, 0, 'new ASG launches ' + str(capacity) + ' instances'))
+            continue
+        if change.action == 'remove':
+            capacity = __capacity(old['Resources'][logical_id], old_values)
+            churn.append(Churn(logical_id, capacity, capacity, 0, 'ASG removed, all instances terminated'))
+            continue
+
+        resource = new['Resources'][logical_id]
+        capacity = __capacity(resource, new_values)
+        if change.behavior == REPLACEMENT:
+            churn.append(Churn(logical_id, capacity, capacity, 0, 'ASG replaced'))
+        elif 'VPCZoneIdentifier' in change.properties:
+            churn.append(Churn(logical_id, capacity, capacity, 0, 'subnets changed, ASG rebalances instances'))
+        elif 'LaunchConfigurationName' in change.properties:
+            if __has_rolling_update(resource):
+                churn.append(Churn(logical_id, capacity, capacity, 0, 'new launch configuration, rolling update'))
+            else:
+                churn.append(Churn(logical_id, capacity, 0, capacity,
+                                   'new launch configuration, no UpdatePolicy: running instances left stale'))
+    return churn
+
+
+def __parse_params(pairs):
+    params = {}
+    for pair in pairs or []:
+        name, _, value = pair.partition('=')
+        params[name] = value
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Predict CloudFormation update behavior between two templates')
+    parser.add_argument('old', help='previously deployed template (JSON)')
+    parser.add_argument('new', help='newly generated template (JSON)')
+    parser.add_argument('--old-param', action='append', metavar='NAME=VALUE',
+                        help='parameter value the old template is deployed with, instead of its Default')
+    parser.add_argument('--new-param', action='append', metavar='NAME=VALUE',
+                        help='parameter value the new template will be deployed with, instead of its Default')
+    parser.add_argument('--fail-on', choices=[SOME_INTERRUPTION, REPLACEMENT],
+                        help='exit with status 1 if any change is at least this disruptive')
+    args = parser.parse_args()
+
+    old, new = load_template(args.old), load_template(args.new)
+    old_params, new_params = __parse_params(args.old_param), __parse_params(args.new_param)
+    try:
+        changes = diff_templates(old, new, old_params, new_params)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not changes:
+        print('no resource changes')
+    for c in changes:
+        print('{:<18} {:<7} {:<28} {}'.format(c.behavior, c.action, c.logical_id, c.resource_type))
+        for prop, behavior in sorted(c.properties.items()):
+            print('    {:<30} {}'.format(prop, behavior))
+        for reason in c.reasons:
+            print('    ({})'.format(reason))
+
+    churn = estimate_churn(old, new, changes, old_params, new_params)
+    if churn:
+        print()
+        print('instance churn per ASG:')
+    for c in churn:
+        print('    {:<14} capacity={} replaced={} stale={}  {}'.format(c.asg, c.capacity, c.replaced, c.stale,
+                                                                       c.reason))
+
+    if args.fail_on and any(SEVERITY[c.behavior] >= SEVERITY[args.fail_on] for c in changes):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -56,6 +56,10 @@ repo_url=$(get_tag repo-url); [ -n "$repo_url" ] || error getting repo-url tag
 repo_branch=$(get_tag repo-branch); [ -n "$repo_branch" ] || error getting repo-branch tag
 env_file=$(get_tag env-file); [ -n "$env_file" ] || error getting env-file tag
 
+# the cache-endpoint tag is set only when the stack creates a Redis cache; it is empty otherwise. The same value
+# is written into the comment after the first line of this script (see with_cache_endpoint in cache.py)
+cache_endpoint=$(get_tag cache-endpoint)
+
 # create deploy dir owned by ubuntu user
 if [ ! -e $deploy_dir ]; then
 	mkdir -p $deploy_dir && chown ubuntu:ubuntu $deploy_dir
@@ -82,6 +86,19 @@ git pull || error pulling repo changes
 echo setting PHP env-vars from $env_file
 cp $env_file .env || error creating copying to $env_file
 
+# when there is a cache, move sessions, cache and queues off the DB and onto Redis
+if [ -n "$cache_endpoint" ]; then
+	echo using redis at $cache_endpoint for sessions, cache and queues
+	sed -i -e '/^REDIS_HOST=/d' -e '/^REDIS_PORT=/d' -e '/^CACHE_DRIVER=/d' -e '/^SESSION_DRIVER=/d' \
+		-e '/^QUEUE_DRIVER=/d' -e '/^QUEUE_CONNECTION=/d' .env || error editing .env
+	echo REDIS_HOST=$cache_endpoint >> .env
+	echo REDIS_PORT=6379 >> .env
+	echo CACHE_DRIVER=redis >> .env
+	echo SESSION_DRIVER=redis >> .env
+	echo QUEUE_DRIVER=redis >> .env
+	echo QUEUE_CONNECTION=redis >> .env
+fi
+
 echo initializing DB schema
 php composer.phar install || error initializing DB schema
 
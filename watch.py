@@ -0,0 +1,124 @@
+# Written for Python 3
+
+# Regenerates the CloudFormation templates whenever their inputs change. Runs in one long-lived process, so
+# troposphere and awacs are imported once; on each save only the builders whose inputs changed are re-run, with
+# just the changed modules reloaded, and an output file is only rewritten when its content changes.
+#
+# Usage: python watch.py [--out-dir .] [--interval 0.2] [--once]
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# output file -> (entry module, build function, helper modules, other input files)
+# Helper modules are listed dependencies first: when one changes it is reloaded along with every helper after it
+# and the entry module, so names imported with 'from x import y' are picked up again.
+BUILDERS = {
+    'vpc.json': ('make_vpc', 'build_vpc', ['cidr_planner'], []),
+    'app_cluster.json': ('make_app_cluster', 'build_app_cluster',
+                         ['utils', 'security_groups', 'load_balancer', 'autoscaling_group', 'iam', 'cache'],
+                         ['user_data_spa.sh', 'user_data_api.sh']),
+}
+
+
+# same formatting as Template.to_json(), so the output matches 'python make_app_cluster.py > app_cluster.json'
+def to_json(template):
+    return json.dumps(template, indent=4, sort_keys=True, separators=(',', ': '))
+
+
+def inputs(builder):
+    entry, _, helpers, files = builder
+    return [m + '.py' for m in helpers] + [entry + '.py'] + files
+
+
+class Watcher(object):
+    def __init__(self, out_dir, log=print):
+        self.out_dir = out_dir
+        self.log = log
+        self.mtimes = {}
+        self.written = {}
+        if HERE not in sys.path:
+            sys.path.insert(0, HERE)
+
+    def __mtime(self, file_name):
+        try:
+            return os.stat(os.path.join(HERE, file_name)).st_mtime
+        except OSError:
+            return None
+
+    # files whose modification time differs from the last check (all of them on the first call)
+    def changed_files(self):
+        changed = set()
+        for builder in BUILDERS.values():
+            for file_name in inputs(builder):
+                mtime = self.__mtime(file_name)
+                if self.mtimes.get(file_name, -1) != mtime:
+                    self.mtimes[file_name] = mtime
+                    changed.add(file_name)
+        return changed
+
+    def __reload(self, builder, changed):
+        entry, _, helpers, _ = builder
+        modules = helpers + [entry]
+        first = next((i for i, m in enumerate(modules) if m + '.py' in changed), None)
+        if first is None:
+            return importlib.import_module(entry)
+        for m in modules[first:]:
+            if m in sys.modules:
+                importlib.reload(sys.modules[m])
+            else:
+                importlib.import_module(m)
+        return sys.modules[entry]
+
+    # run the builders affected by the changed files; returns {output file: seconds taken} for the ones that ran
+    def rebuild(self, changed):
+        timings = {}
+        for output, builder in sorted(BUILDERS.items()):
+            if not changed & set(inputs(builder)):
+                continue
+            started = time.perf_counter()
+            try:
+                module = self.__reload(builder, changed)
+                text = to_json(getattr(module, builder[1])())
+            except Exception as e:
+                self.log('{}: {}: {}'.format(output, type(e).__name__, e))
+                continue
+            if self.written.get(output) != text:
+                with open(os.path.join(self.out_dir, output), 'w') as f:
+                    f.write(text + '\n')
+                self.written[output] = text
+            timings[output] = time.perf_counter() - started
+            self.log('{}: rebuilt in {:.0f} ms'.format(output, timings[output] * 1000))
+        return timings
+
+    def run(self, interval):
+        while True:
+            changed = self.changed_files()
+            if changed:
+                self.rebuild(changed)
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Regenerate CloudFormation templates when their inputs change')
+    parser.add_argument('--out-dir', default='.', help='where to write vpc.json and app_cluster.json')
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between checks for changes')
+    parser.add_argument('--once', action='store_true', help='build everything once and exit')
+    args = parser.parse_args()
+
+    watcher = Watcher(args.out_dir)
+    watcher.rebuild(watcher.changed_files())
+    if not args.once:
+        try:
+            watcher.run(args.interval)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()